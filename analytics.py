@@ -0,0 +1,214 @@
+"""Submission analytics for instructors: every submission, its feedback, criterion scores and outcome.
+
+main.py hands each finished submission to an AnalyticsSink, which only puts it on a bounded queue;
+a background thread writes the queue out in batches, so the submit path never waits on the disk.
+Each batch is appended to the current file as its own gzip member, which keeps everything written
+before a crash readable. Files are rotated after a set number of records, and named by start time
+and process id, so several worker processes can share one directory.
+
+When the queue is full the sink waits up to block_seconds for room, then drops a record: the new
+one ("drop_newest") or the oldest one still queued ("drop_oldest"). Drops are counted in stats().
+
+Summarize a directory, streaming through the files so memory doesn't grow with the record count:
+
+    python analytics.py analytics/
+    python analytics.py analytics/ --json
+"""
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+
+FILE_PATTERN = "submissions-*.jsonl.gz"
+
+DROP_POLICIES = ("drop_newest", "drop_oldest")
+
+
+class AnalyticsSink:
+
+    def __init__(self, directory, queue_size=10_000, batch_size=500, flush_seconds=2, file_records=100_000,
+                 block_seconds=0.05, when_full="drop_newest"):
+        if when_full not in DROP_POLICIES:
+            raise ValueError(f"when_full must be one of {DROP_POLICIES}, not {when_full!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.file_records = file_records
+        self.block_seconds = block_seconds
+        self.when_full = when_full
+        self.lock = threading.Lock()
+        self.closing = threading.Event()
+        self.path = None
+        self.records_in_file = 0
+        self.files = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._write_behind, name="analytics-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def emit(self, record):
+        """Queue a record for writing. Returns False if it (or an older record) had to be dropped."""
+        record = {"ts": time.time(), **record}
+        try:
+            if self.block_seconds:
+                self.queue.put(record, timeout=self.block_seconds)
+            else:
+                self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            pass
+        if self.when_full == "drop_oldest":
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+        with self.lock:
+            self.dropped += 1
+        return False
+
+    def close(self, timeout=5):
+        """Write out whatever is still queued, then stop the writer."""
+        self.closing.set()
+        self.thread.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            return {"queued": self.queue.qsize(), "written": self.written, "dropped": self.dropped,
+                    "failed": self.failed, "files": self.files}
+
+    def _write_behind(self):
+        while not (self.closing.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"Analytics batch of {len(batch)} not written::: {e}")
+                with self.lock:
+                    self.failed += len(batch)
+
+    def _write(self, batch):
+        if self.path is None or self.records_in_file >= self.file_records:
+            name = f"submissions-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.files}.jsonl.gz"
+            self.path = os.path.join(self.directory, name)
+            self.records_in_file = 0
+            with self.lock:
+                self.files += 1
+        lines = "".join(json.dumps(record, separators=(",", ":"), default=str) + "\n" for record in batch)
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(lines.encode("utf-8")))
+        self.records_in_file += len(batch)
+        with self.lock:
+            self.written += len(batch)
+
+
+def read_records(directory):
+    """Yield every record in directory, oldest file first, one line at a time."""
+    for path in sorted(glob.glob(os.path.join(directory, FILE_PATTERN))):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            #A file still being written, or cut short by a crash; its complete batches were read
+            print(f"{path}: stopped at an incomplete batch ({e})", file=sys.stderr)
+
+
+class PhaseSummary:
+
+    def __init__(self):
+        self.submissions = 0
+        self.skipped = 0
+        self.scored = 0
+        self.decided = 0
+        self.passed = 0
+        self.score_total = 0
+        self.scores = Counter()
+        self.criterion_totals = defaultdict(float)
+        self.criterion_counts = Counter()
+
+    def add(self, record):
+        self.submissions += 1
+        self.skipped += bool(record.get("skipped"))
+        if record.get("score") is not None:
+            self.scored += 1
+            self.score_total += record["score"]
+            self.scores[record["score"]] += 1
+        #Runs stopped at an early decision have an outcome but no full score
+        if record.get("passed") is not None:
+            self.decided += 1
+        if record.get("passed"):
+            self.passed += 1
+        for name, points in (record.get("criteria") or {}).items():
+            self.criterion_totals[name] += points
+            self.criterion_counts[name] += 1
+
+    def as_dict(self):
+        return {
+            "submissions": self.submissions,
+            "skipped": self.skipped,
+            "scored": self.scored,
+            "pass_rate": self.passed / self.decided if self.decided else None,
+            "mean_score": self.score_total / self.scored if self.scored else None,
+            "score_distribution": {str(score): count for score, count in sorted(self.scores.items())},
+            "criterion_means": {name: self.criterion_totals[name] / count for name, count in self.criterion_counts.items()},
+        }
+
+
+def summarize(records):
+    """Pass rates and score distributions per (exercise, phase)."""
+    summaries = defaultdict(PhaseSummary)
+    for record in records:
+        summaries[(record.get("exercise", ""), record.get("phase", ""))].add(record)
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize submission analytics per exercise and phase.")
+    parser.add_argument("directory", help="ANALYTICS_DIR the app writes to")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    summaries = summarize(read_records(args.directory))
+    if args.json:
+        print(json.dumps({f"{exercise or 'default'}/{phase}": summary.as_dict()
+                          for (exercise, phase), summary in sorted(summaries.items())}, indent=2))
+        return 0
+    for (exercise, phase), summary in sorted(summaries.items()):
+        s = summary.as_dict()
+        pass_rate = "-" if s["pass_rate"] is None else f"{s['pass_rate']:.0%}"
+        mean = "-" if s["mean_score"] is None else f"{s['mean_score']:.2f}"
+        distribution = " ".join(f"{score}:{count}" for score, count in s["score_distribution"].items())
+        print(f"{exercise or 'default'}/{phase}: {s['submissions']} submissions, {s['skipped']} skipped, "
+              f"pass rate {pass_rate}, mean score {mean}, scores {distribution or '-'}")
+        for name, mean_points in s["criterion_means"].items():
+            print(f"    {name}: {mean_points:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""The exercise's SHARED_ASSET, read once per process instead of on every rerun of every session.
+
+An AssetCache hashes each file once and keeps its bytes in memory, up to memory_bytes. A file's
+modification time and size are checked at most every check_seconds, and a changed file is read
+and hashed again. Larger files are only hashed; their bytes are read from disk when a student
+actually downloads them.
+
+publish() copies an asset into Streamlit's static folder under a name that starts with its
+content hash. Streamlit streams the copy from disk, with ETag and Last-Modified headers, at a URL
+that only changes when the file does, so browsers and any proxy in front of the app can cache it.
+"""
+import glob
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+
+class Asset(NamedTuple):
+    path: str
+    name: str
+    mime: str
+    size: int
+    mtime: int
+    digest: str
+    #None for files over the cache's memory_bytes, which are read on demand
+    data: Optional[bytes]
+
+    def read(self):
+        if self.data is not None:
+            return self.data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    @property
+    def versioned_name(self):
+        return f"{self.digest[:16]}-{self.name}"
+
+
+def load_asset(path, name, memory_bytes, chunk_size=1 << 20):
+    """Hash the file at path in chunks, keeping its bytes if it is at most memory_bytes."""
+    stat = os.stat(path)
+    hasher = hashlib.sha256()
+    chunks = [] if stat.st_size <= memory_bytes else None
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+    mime = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    data = b"".join(chunks) if chunks is not None else None
+    return Asset(path, name, mime, stat.st_size, stat.st_mtime_ns, hasher.hexdigest(), data)
+
+
+class AssetCache:
+
+    def __init__(self, memory_bytes=20_000_000, check_seconds=2, static_dir=""):
+        self.memory_bytes = memory_bytes
+        self.check_seconds = check_seconds
+        self.static_dir = static_dir
+        self.lock = threading.Lock()
+        #path -> [asset, monotonic time the file was last checked]
+        self.loaded = {}
+        self.loads = 0
+        self.reloads = 0
+        self.published = 0
+
+    def get(self, path, name=None):
+        """The Asset at path, downloaded as name (the file's own name by default). Raises OSError if it can't be read."""
+        name = name or os.path.basename(path)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.loaded.get(path)
+            if entry and entry[0].name == name and now - entry[1] < self.check_seconds:
+                return entry[0]
+        current = entry[0] if entry else None
+        stat = os.stat(path)
+        if current and current.name == name and (stat.st_mtime_ns, stat.st_size) == (current.mtime, current.size):
+            asset = current
+        else:
+            asset = load_asset(path, name, self.memory_bytes)
+        with self.lock:
+            if asset is not current:
+                if current:
+                    self.reloads += 1
+                else:
+                    self.loads += 1
+            self.loaded[path] = [asset, now]
+        return asset
+
+    def publish(self, asset):
+        """Copy asset into static_dir under its versioned name, once, and return that file name.
+        Earlier versions of the same asset are removed."""
+        target = os.path.join(self.static_dir, asset.versioned_name)
+        if os.path.exists(target):
+            return asset.versioned_name
+        os.makedirs(self.static_dir, exist_ok=True)
+        #Written under a temporary name and renamed, so a concurrent request never sees half a file
+        partial = f"{target}.{os.getpid()}.{threading.get_ident()}.partial"
+        with open(partial, "wb") as out:
+            if asset.data is not None:
+                out.write(asset.data)
+            else:
+                with open(asset.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        out.write(chunk)
+        os.replace(partial, target)
+        for old in glob.glob(os.path.join(glob.escape(self.static_dir), "*-" + glob.escape(asset.name))):
+            if os.path.basename(old) != asset.versioned_name:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        with self.lock:
+            self.published += 1
+        return asset.versioned_name
+
+    def stats(self):
+        with self.lock:
+            return {"loaded": len(self.loaded), "loads": self.loads, "reloads": self.reloads,
+                    "published": self.published,
+                    "memory_bytes": sum(len(entry[0].data or b"") for entry in self.loaded.values())}
@@ -0,0 +1,149 @@
+"""Grade a cohort's past submissions against the rubrics in config.PHASES, without the Streamlit UI.
+
+The input is a CSV or JSONL export with one row per student and one column per scored phase
+(e.g. "first_draft", "final_draft"). Each graded submission is appended to the output JSONL as
+soon as it finishes, so an interrupted run can be restarted with the same arguments and will
+skip everything already in the output file. Submissions are scored on the app's LLM_BACKEND.
+
+    python batch_grade.py submissions.csv grades.jsonl --workers 8
+    python batch_grade.py budget.csv budget_grades.jsonl --exercise budget_narrative
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import LLM_BACKEND, SCORING_FALLBACK
+from main import get_assistant, get_client, get_exercise_registry, score_submission, chat_score_submission, parse_score
+
+
+def scored_phases(exercise):
+    return {phase.name: phase for phase in exercise.phase_plan if phase.scored}
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def read_done(path):
+    #Everything already in the output file has been graded; only successful grades are written there
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    #A partial last line from an interrupted run is graded again
+                    continue
+                #Output that couldn't be read as a score is graded again
+                if record.get("score") is not None:
+                    done.add((record["id"], record["phase"]))
+    return done
+
+
+def build_tasks(rows, phases, done, id_column):
+    for row_number, row in enumerate(rows):
+        submission_id = str(row.get(id_column) or row_number)
+        for phase_name in phases:
+            text = row.get(phase_name)
+            if text and (submission_id, phase_name) not in done:
+                yield submission_id, phase_name, text
+
+
+#On the chat backend assistant_id is None and each submission is scored with a chat completion, as in the app
+def score_on_route(client, exercise, assistant_id, phase, text, route):
+    if LLM_BACKEND == "chat":
+        return chat_score_submission(client, route, phase.rubric, text, instructions=exercise.ASSISTANT_INSTRUCTIONS)
+    return score_submission(client, assistant_id, phase.rubric, text, route)
+
+
+def grade(client, exercise, assistant_id, submission_id, phase_name, text, phase):
+    started = time.perf_counter()
+    route = phase.scoring_route
+    result = score_on_route(client, exercise, assistant_id, phase, text, route)
+    score, passed = parse_score(result, phase)
+    if passed is None and SCORING_FALLBACK and phase.fallback_route:
+        route = phase.fallback_route
+        result = score_on_route(client, exercise, assistant_id, phase, text, route)
+        score, passed = parse_score(result, phase)
+    return {
+        "id": submission_id,
+        "phase": phase_name,
+        "model": route.model,
+        "score": score,
+        "minimum_score": phase.minimum_score,
+        "passed": passed,
+        "result": result,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade exported submissions against the PHASES rubrics.")
+    parser.add_argument("input", help="CSV or JSONL file with one column per scored phase")
+    parser.add_argument("output", help="JSONL file that results are appended to")
+    parser.add_argument("--workers", type=int, default=8, help="Submissions graded at the same time")
+    parser.add_argument("--id-column", default="id", help="Column identifying the student or submission")
+    parser.add_argument("--exercise", default="", help="Exercise in EXERCISES_DIR to grade against, instead of config.py")
+    args = parser.parse_args(argv)
+
+    exercise = get_exercise_registry().get(args.exercise)
+    phases = scored_phases(exercise)
+    done = read_done(args.output)
+    tasks = build_tasks(read_rows(args.input), phases, done, args.id_column)
+    client = get_client()
+    #An exercise without an ASSISTANT_ID gets its assistant created once, as it would in the app
+    assistant_id = None
+    if LLM_BACKEND != "chat":
+        assistant_id = get_assistant(exercise.ASSISTANT_ID, exercise.OPENAI_MODEL, exercise.ASSISTANT_NAME, exercise.ASSISTANT_INSTRUCTIONS).id
+
+    graded = failed = 0
+    started = time.perf_counter()
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        in_flight = {}
+        while True:
+            #Keep at most two submissions per worker queued, so huge exports are never loaded at once
+            for submission_id, phase_name, text in tasks:
+                future = pool.submit(grade, client, exercise, assistant_id, submission_id, phase_name, text, phases[phase_name])
+                in_flight[future] = (submission_id, phase_name)
+                if len(in_flight) >= args.workers * 2:
+                    break
+            if not in_flight:
+                break
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                submission_id, phase_name = in_flight.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed to grade {submission_id}/{phase_name}: {e}", file=sys.stderr)
+                    continue
+                if record["score"] is None:
+                    failed += 1
+                    print(f"Failed to grade {submission_id}/{phase_name}: unreadable score from {record['model']}", file=sys.stderr)
+                    continue
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                graded += 1
+            elapsed = time.perf_counter() - started
+            print(f"\rGraded {graded}, failed {failed}, {graded / elapsed * 60:.1f} submissions/minute", end="", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    rate = graded / elapsed * 60 if elapsed else 0
+    print(f"\nGraded {graded} submissions ({failed} failed, {len(done)} already done) in {elapsed:.1f}s: {rate:.1f} submissions/minute", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Measure what the first student after a deploy waits for: importing the app and the first API request.
+
+Each import is timed in a fresh interpreter, so nothing is already in sys.modules. The first request
+is timed on a new pooled client (DNS, TLS handshake and the request itself) and then again on the
+same client, which reuses the kept-alive connection the way a warmed-up server does.
+
+    python bench_startup.py --runs 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+def time_import(module, runs):
+    seconds = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        seconds.append(float(output.strip().splitlines()[-1]))
+    return seconds
+
+
+def time_requests(request, runs):
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        request()
+        seconds.append(time.perf_counter() - started)
+    return seconds
+
+
+def report(label, seconds):
+    print(f"{label:<28} median {statistics.median(seconds) * 1000:8.1f} ms   max {max(seconds) * 1000:8.1f} ms   ({len(seconds)} runs)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the app's import time and first-request latency.")
+    parser.add_argument("--runs", type=int, default=5, help="Times each measurement is repeated")
+    parser.add_argument("--skip-requests", action="store_true", help="Only time the imports, without calling the API")
+    args = parser.parse_args(argv)
+
+    for module in ("openai", "streamlit", "main"):
+        report(f"import {module}", time_import(module, args.runs))
+
+    if args.skip_requests:
+        return 0
+
+    from main import get_client
+    from config import ASSISTANT_ID, OPENAI_MODEL
+
+    started = time.perf_counter()
+    client = get_client()
+    report("build client", [time.perf_counter() - started])
+
+    request = lambda: client.models.retrieve(OPENAI_MODEL)
+    if ASSISTANT_ID:
+        request = lambda: client.beta.assistants.retrieve(assistant_id=ASSISTANT_ID)
+    report("first request (cold)", time_requests(request, 1))
+    report("request (warm connection)", time_requests(request, args.runs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,6 +28,9 @@ Using AI to provide feedback and score like this is a very experimental process.
 
  """
 
+#A file students can download, e.g. {"path": "assets/rfp.pdf", "name": "rfp.pdf", "button_text": "Download the RFP"}.
+#Phases with "asset_grounded": True also attach it to the student's message, so the AI reads the file itself. Set "file_id" to a copy
+#already uploaded to OpenAI, or "upload": True to upload it once per process and version.
 SHARED_ASSET = ""
 
 COMPLETION_MESSAGE = "You've reached the end! I hope you learned something!"
@@ -35,6 +38,84 @@ COMPLETION_CELEBRATION = False
 
 SCORING_DEBUG_MODE = True
 
+#Streamed responses are redrawn at most once per frame: every STREAM_FRAME_SECONDS or every STREAM_FRAME_CHARS new characters, whichever comes first
+STREAM_FRAME_SECONDS = 0.05
+STREAM_FRAME_CHARS = 200
+
+#Score scored phases on a separate thread at the same time as the feedback run, instead of after it on the same thread
+CONCURRENT_SCORING = True
+SCORING_WORKERS = 8
+
+#Identical submissions reuse earlier responses for phases with "cache_responses": True. Set RESPONSE_CACHE_DIR to also keep them on disk.
+#A cached answer also needs the same earlier inputs and feedback: the phase's context_phases on the chat backend, every earlier phase on the Assistants thread.
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_DIR = ""
+RESPONSE_CACHE_DISK_BYTES = 50_000_000
+
+#Run latency, token and pass/fail metrics. Served in Prometheus format at http://127.0.0.1:METRICS_PORT/metrics (0 turns it off)
+#and appended to a rotating JSONL file ("" turns it off). METRICS_DEBUG_MODE shows this session's numbers in the sidebar.
+METRICS_PORT = 9464
+METRICS_JSONL_PATH = "metrics.jsonl"
+METRICS_DEBUG_MODE = False
+
+#Process-wide admission control, sized to the account's rate limits (0 means unlimited). Feedback runs are admitted before scoring runs.
+#A student who can't be admitted within ADMISSION_TIMEOUT seconds is asked to submit again.
+#The limits are the account's; each of the WORKER_PROCESSES serving the app on this host admits its share of them.
+RATE_LIMIT_RPM = 500
+RATE_LIMIT_TPM = 300_000
+WORKER_PROCESSES = 1
+ADMISSION_TIMEOUT = 120
+
+#Run lifecycle. A run is cancelled once it passes its deadline (a phase can set its own "deadline_seconds"), or when the student reruns or leaves mid-stream.
+#Transient failures before the first token are retried RUN_RETRIES times, with jittered backoff starting at RUN_RETRY_DELAY seconds.
+RUN_DEADLINE_SECONDS = 120
+RUN_READ_TIMEOUT = 30
+RUN_RETRIES = 2
+RUN_RETRY_DELAY = 1
+
+#Where session progress is kept. "sqlite" shares it between worker processes on one host and survives restarts; "memory" keeps it in this process only.
+SESSION_BACKEND = "sqlite"
+SESSION_DB_PATH = "sessions.db"
+#Progress is written behind the UI at most this many seconds later, or sooner when this many sessions are waiting
+SESSION_FLUSH_SECONDS = 0.5
+SESSION_BATCH_SIZE = 100
+#Progress not saved for this many seconds is deleted, so drafts and feedback aren't kept forever (0 keeps them)
+SESSION_TTL_SECONDS = 14 * 24 * 3600
+#Resume links in the URL are signed with the SESSION_SECRET environment variable, or else a random secret generated into this file
+SESSION_SECRET_PATH = ".session_secret"
+
+#Every finished submission (text, feedback, criterion scores, pass/fail) is appended to gzipped JSONL files in ANALYTICS_DIR ("" turns it off),
+#written in batches by a background thread. When more than ANALYTICS_QUEUE_SIZE records are waiting, a submit waits up to ANALYTICS_BLOCK_SECONDS
+#and then a record is dropped ("drop_newest" or "drop_oldest"). Summarize with: python analytics.py analytics/
+ANALYTICS_DIR = "analytics"
+ANALYTICS_QUEUE_SIZE = 10_000
+ANALYTICS_BATCH_SIZE = 500
+ANALYTICS_FLUSH_SECONDS = 2
+ANALYTICS_FILE_RECORDS = 100_000
+ANALYTICS_BLOCK_SECONDS = 0.05
+ANALYTICS_WHEN_FULL = "drop_newest"
+
+#Other exercises served by this process, opened with ?exercise=<name>. Each is a <name>.py/.json/.yaml file in EXERCISES_DIR with
+#the same settings as this file (see exercises.py). At most EXERCISE_CACHE_SIZE are kept compiled, and files are checked for edits every EXERCISE_RELOAD_SECONDS.
+EXERCISES_DIR = "exercises"
+EXERCISE_CACHE_SIZE = 32
+EXERCISE_RELOAD_SECONDS = 2
+
+#SHARED_ASSET files are read once per process, and again when they change (checked every ASSET_RELOAD_SECONDS).
+#Files up to ASSET_MEMORY_BYTES are kept in memory; larger ones are read from disk only when a student downloads them.
+ASSET_MEMORY_BYTES = 20_000_000
+ASSET_RELOAD_SECONDS = 2
+#Link to a content-hashed copy in Streamlit's static folder instead of a download button, so the file is streamed from disk at a
+#URL that only changes with the file. Needs enableStaticServing = true under [server] in .streamlit/config.toml.
+ASSET_STATIC_SERVING = False
+
+#Canned feedback for submissions caught by a phase's "prescreen" rules, which are answered without calling the AI. See prescreen.py for the rules.
+PRESCREEN_MESSAGES = {
+    "too_short": "Your response is too short for me to give useful feedback. Please write a complete draft and submit again.",
+    "unchanged_from_default": "You submitted the example text without changing it. Please write your own version and submit again.",
+    "unchanged_from_prior": "Your second draft is essentially unchanged from your first draft. Please incorporate the feedback you received and submit again.",
+}
+
  ####### PHASES INFORMATION #########
 
 PHASES = {
@@ -47,6 +128,7 @@ PHASES = {
     "first_draft": {
         "type": "text_area",
         "height": 300,
+        "context_phases": ["org_name"],
         "label": """Please write your first draft of your proposal introduction.""",
         "button_label": "Submit",
         "value": "Founded in 1981, we now operate 38 stores in six states, including the bookstore at the Anasazi Heritage Center. SNCHA supports the educational, interpretive and research programs of three federal agencies. We also publish The Escalante Community: Where did they go? Why did they leave?, and The Dolores River Guide.  [Mission] The Heritage Center opened to the public in 1988 and averages 40,000+ visitors each year.  SNCHA and the AHC received two previous Colorado State Historical Fund grants totaling more than $135,000, committed to the Lowry CD-rom People in the Past Project. Historical Society product reviews for the project were excellent.",
@@ -73,6 +155,8 @@ PHASES = {
                     0 points - The response does not include any testimonials or accomplishments
         """,
         "minimum_score": 2,
+        "cache_responses": True,
+        "prescreen": {"min_chars": 100},
         "user_input": "",
         "ai_response": "",
         "allow_skip": True
@@ -80,6 +164,7 @@ PHASES = {
     "final_draft": {
        "type": "text_area",
        "height": 300,
+       "context_phases": ["first_draft"],
        "label": "Now, please attempt to incorporate the relevant feedback and write a second draft fo your introduction.",
        "value":"""Founded in 1981, SNCHA (Southern New Chelsea Housing Association) supports the educational, interpretive and research programs of three federal agencies. We now operate 38 stores in six states, including the bookstore at the Anasazi Heritage Center. We also publish The Escalante Community: Where did they go? Why did they leave?, and The Dolores River Guide.  
 
@@ -101,6 +186,7 @@ The Heritage Center opened to the public in 1988 and averages 40,000+ visitors e
                     0 points - The response does not include any testimonials or accomplishments
         """,
        "minimum_score": 4,
+       "prescreen": {"min_chars": 100, "compare_to": "first_draft", "max_similarity": 0.98},
        "user_input": "",
        "ai_response": "",
        "allow_skip": True
@@ -129,6 +215,8 @@ The Heritage Center opened to the public in 1988 and averages 40,000+ visitors e
 }
 
 ######## AI CONFIGURATION #############
+#"assistants" keeps the whole session in one Assistants thread. "chat" sends stateless chat completions that only carry each phase's context_phases.
+LLM_BACKEND = "assistants"
 OPENAI_MODEL = "gpt-4-turbo"
 ASSISTANT_ID = "asst_2Ax6jYO4FGPio7DvHGkjZhU2"
 ASSISTANT_THREAD = ""
@@ -137,6 +225,24 @@ MAX_TOKENS = 1000
 PRESENCE_PENALTY = 0
 TEMPERATURE = 1
 TOP_P = 1
+#Model, completion limit and sampling for each kind of run. A route without "model" uses OPENAI_MODEL.
+#Scoring only returns a small JSON object, so it can go to a cheaper tier, e.g. "model": "gpt-4o-mini".
+#A phase can override any of these with its own "feedback_route" or "scoring_route" dict. See routing.py.
+MODEL_ROUTES = {
+    "feedback": {"max_tokens": MAX_TOKENS, "temperature": TEMPERATURE, "top_p": TOP_P},
+    "scoring": {"max_tokens": 400, "temperature": .2, "top_p": TOP_P},
+}
+#When a scoring model other than the feedback model returns a score that can't be read, score again on the feedback model
+SCORING_FALLBACK = True
+#Seconds before the cached assistant is retrieved again from the API
+ASSISTANT_CACHE_TTL = 3600
+#Connection pool shared by every session. Size it for the sessions you expect to stream at once (feedback plus concurrent scoring).
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE = 40
+#Seconds an idle connection is kept open for the next request
+HTTP_KEEPALIVE_EXPIRY = 60
+#Open a connection and resolve the assistant in the background when the server starts
+WARM_UP_ON_START = True
 
 ########## AI ASSISTANT CONFIGURATION #######
 ASSISTANT_NAME = "Grant Reviewer"
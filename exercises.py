@@ -0,0 +1,171 @@
+"""Exercise definitions loaded by name, so one server process can host many exercises.
+
+An exercise is a file in EXERCISES_DIR named <name>.py, <name>.json, <name>.yaml or <name>.yml,
+opened with ?exercise=<name> in the URL. It sets any of EXERCISE_SETTINGS, with the same names and
+shapes as config.py; settings it leaves out fall back to config.py. Without ?exercise= the app
+serves config.py itself, exactly as before.
+
+    # exercises/budget_narrative.json
+    {"APP_TITLE": "Writing Your Budget Narrative", "ASSISTANT_ID": "asst_...", "PHASES": {...}}
+
+Definitions are compiled the first time they are asked for and kept in a small LRU. A file's
+modification time is checked at most every check_seconds, and a changed file is compiled again, so
+edits show up without a restart. An edit that doesn't compile is reported and the previous
+version keeps being served.
+"""
+import json
+import os
+import re
+import runpy
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple
+
+from phase_plan import PhasePlan, compile_phases
+
+
+#The config.py settings an exercise may set. Process-wide settings (rate limits, caches, metrics) stay in config.py.
+EXERCISE_SETTINGS = (
+    "APP_TITLE", "APP_INTRO", "APP_HOW_IT_WORKS", "SHARED_ASSET", "COMPLETION_MESSAGE", "COMPLETION_CELEBRATION",
+    "SCORING_DEBUG_MODE", "OPENAI_MODEL", "ASSISTANT_ID", "ASSISTANT_THREAD", "ASSISTANT_NAME", "ASSISTANT_INSTRUCTIONS",
+    "MODEL_ROUTES", "PHASES",
+)
+
+EXTENSIONS = (".py", ".json", ".yaml", ".yml")
+
+#Exercise names come from the URL, so they can't contain path separators or dots
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class ExerciseConfigError(ValueError):
+    pass
+
+
+class ExerciseNotFound(LookupError):
+    pass
+
+
+class Exercise(NamedTuple):
+    name: str
+    path: str
+    mtime: int
+    settings: Mapping[str, Any]
+    phase_plan: PhasePlan
+
+    def __getattr__(self, setting):
+        #exercise.APP_TITLE and friends read the exercise's settings
+        try:
+            return self.settings[setting]
+        except KeyError:
+            raise AttributeError(setting) from None
+
+
+def read_settings(path):
+    """The EXERCISE_SETTINGS a definition file sets. A .py file may define helpers and other names,
+    which are ignored; a JSON or YAML file may only contain settings."""
+    if path.endswith(".py"):
+        names = runpy.run_path(path)
+        return {name: value for name, value in names.items() if name in EXERCISE_SETTINGS}
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".json"):
+            settings = json.load(f)
+        else:
+            try:
+                import yaml
+            except ImportError:
+                raise ExerciseConfigError(f"{path}: YAML exercises need PyYAML (pip install pyyaml)") from None
+            settings = yaml.safe_load(f)
+    if not isinstance(settings, dict):
+        raise ExerciseConfigError(f"{path}: expected an object of settings")
+    unknown = set(settings) - set(EXERCISE_SETTINGS)
+    if unknown:
+        raise ExerciseConfigError(f"{path}: unknown settings {sorted(unknown)}; expected some of {EXERCISE_SETTINGS}")
+    return settings
+
+
+def compile_exercise(name, path, mtime, settings, defaults, build_scoring_instructions):
+    merged = {setting: defaults[setting] for setting in EXERCISE_SETTINGS}
+    merged.update(settings)
+    phase_plan = compile_phases(merged["PHASES"], build_scoring_instructions, merged["MODEL_ROUTES"], merged["OPENAI_MODEL"])
+    return Exercise(name, path, mtime, MappingProxyType(merged), phase_plan)
+
+
+class ExerciseRegistry:
+
+    def __init__(self, directory, defaults, build_scoring_instructions, max_loaded=32, check_seconds=2):
+        self.directory = directory
+        self.defaults = defaults
+        self.build_scoring_instructions = build_scoring_instructions
+        self.max_loaded = max_loaded
+        self.check_seconds = check_seconds
+        self.default = compile_exercise("", "", 0, {}, defaults, build_scoring_instructions)
+        self.lock = threading.Lock()
+        #name -> [exercise, monotonic time its file was last checked, mtime of an edit that failed to compile]
+        self.loaded = OrderedDict()
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.failed_reloads = 0
+
+    def get(self, name):
+        """The compiled exercise called name, or the config.py exercise for "".
+        Raises ExerciseNotFound for an unknown name and ExerciseConfigError (or PhaseConfigError)
+        for a definition that doesn't compile."""
+        if not name:
+            return self.default
+        if not NAME_PATTERN.match(name):
+            raise ExerciseNotFound(name)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.loaded.get(name)
+            if entry:
+                self.loaded.move_to_end(name)
+                if now - entry[1] < self.check_seconds:
+                    return entry[0]
+        current, failed_mtime = (entry[0], entry[2]) if entry else (None, None)
+        path = self.find(name)
+        if path is None:
+            with self.lock:
+                self.loaded.pop(name, None)
+            raise ExerciseNotFound(name)
+        mtime = os.stat(path).st_mtime_ns
+        if current and current.path == path and mtime in (current.mtime, failed_mtime):
+            exercise = current
+        else:
+            try:
+                exercise = compile_exercise(name, path, mtime, read_settings(path), self.defaults, self.build_scoring_instructions)
+            except Exception as e:
+                if current is None:
+                    raise
+                #Keep serving the version that worked until the file is fixed
+                print(f"Exercise {name} not reloaded::: {e}")
+                exercise = current
+                failed_mtime = mtime
+                with self.lock:
+                    self.failed_reloads += 1
+        with self.lock:
+            if exercise is not current:
+                if current:
+                    self.reloads += 1
+                else:
+                    self.loads += 1
+            self.loaded[name] = [exercise, now, failed_mtime]
+            self.loaded.move_to_end(name)
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+                self.evictions += 1
+        return exercise
+
+    def find(self, name):
+        for extension in EXTENSIONS:
+            path = os.path.join(self.directory, name + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def stats(self):
+        with self.lock:
+            return {"loaded": len(self.loaded), "loads": self.loads, "reloads": self.reloads,
+                    "evictions": self.evictions, "failed_reloads": self.failed_reloads}
@@ -0,0 +1,139 @@
+"""Lifecycle of in-flight model runs: supersede/abandon cancellation, deadlines and retries.
+
+Each session has at most one run per slot (feedback, scoring) in the process-wide RunRegistry.
+Starting a new run in a slot cancels the previous one, and runs left behind by sessions that
+went away are cancelled once they pass their deadline, so they stop burning tokens and stop
+holding the thread's lock.
+"""
+import random
+import threading
+import time
+
+import openai
+
+
+#Failures worth another attempt, as long as nothing has been shown to the student yet
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+#Run failure codes from the Assistants API that are worth another attempt
+TRANSIENT_RUN_ERRORS = ("rate_limit_exceeded", "server_error")
+
+
+class RunFailed(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(f"{code}: {message}" if message else code)
+        self.code = code
+
+    @property
+    def transient(self):
+        return self.code in TRANSIENT_RUN_ERRORS
+
+
+class RunTimeout(Exception):
+    pass
+
+
+class RunRegistry:
+    """In-flight runs keyed by (session token, slot), each with a cancel callback and a deadline."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.cancelled = 0
+        self.retried = 0
+        self.timed_out = 0
+
+    def start(self, key, deadline_seconds, cancel=None):
+        """Register a new run for key, cancelling the run it supersedes. Returns a handle for update/finish."""
+        handle = object()
+        with self.lock:
+            previous = self.runs.pop(key, None)
+            self.runs[key] = [handle, time.monotonic() + deadline_seconds, cancel]
+        if previous:
+            self._cancel(previous)
+        self.sweep()
+        return handle
+
+    def update(self, key, handle, cancel):
+        """Set the cancel callback once the run's id is known."""
+        with self.lock:
+            entry = self.runs.get(key)
+            if entry and entry[0] is handle:
+                entry[2] = cancel
+
+    def finish(self, key, handle, cancel=False):
+        with self.lock:
+            entry = self.runs.get(key)
+            if not entry or entry[0] is not handle:
+                return
+            del self.runs[key]
+        if cancel:
+            self._cancel(entry)
+
+    def cancel(self, key):
+        """Cancel whatever run is in flight for key, e.g. when its submit is given up."""
+        with self.lock:
+            entry = self.runs.pop(key, None)
+        if entry:
+            self._cancel(entry)
+
+    def sweep(self):
+        """Cancel runs that are past their deadline, e.g. from sessions that were closed mid-stream."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [key for key, entry in self.runs.items() if entry[1] < now]
+            entries = [self.runs.pop(key) for key in expired]
+            self.timed_out += len(entries)
+        for entry in entries:
+            self._cancel(entry)
+
+    def record_retry(self):
+        with self.lock:
+            self.retried += 1
+
+    def record_timeout(self):
+        with self.lock:
+            self.timed_out += 1
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.runs), "cancelled": self.cancelled, "retried": self.retried, "timed_out": self.timed_out}
+
+    def _cancel(self, entry):
+        cancel = entry[2]
+        if cancel is None:
+            return
+        try:
+            cancel()
+        except Exception as e:
+            #The run may already have finished; there is nothing left to stop
+            print(f"Run cancel failed::: {e}")
+            return
+        with self.lock:
+            self.cancelled += 1
+
+
+def retry_stream(open_deltas, attempts, base_delay, on_retry=None):
+    """Yield text from open_deltas(attempt), opening it again after a transient failure.
+
+    Retries only happen before the first piece of text, so a student never sees a response restart.
+    The delay doubles each attempt, with jitter so many sessions don't retry in lockstep.
+    """
+    for attempt in range(attempts + 1):
+        started = False
+        try:
+            for text in open_deltas(attempt):
+                started = True
+                yield text
+            return
+        except TRANSIENT_ERRORS + (RunFailed,) as e:
+            if started or attempt == attempts or (isinstance(e, RunFailed) and not e.transient):
+                raise
+            if on_retry:
+                on_retry(attempt + 1, e)
+            time.sleep(base_delay * 2 ** attempt * random.uniform(0.5, 1.5))
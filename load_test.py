@@ -0,0 +1,193 @@
+"""Drive simulated students through a whole exercise, headless, and report latency in numbers.
+
+Each student is a Streamlit session (streamlit.testing AppTest) running main.py. It fills in each
+phase, submits, and retries a failed phase with a new draft until the exercise is finished.
+AppTest keeps one runtime per process, so --concurrency worker processes each run their students
+one after another.
+
+By default the students talk to a mock_llm_server started here, so nothing is sent to OpenAI and
+the numbers only move when the app changes:
+
+    python load_test.py --students 40 --concurrency 20
+    python load_test.py --students 40 --ttft 1.5 --tokens-per-second 30 --error-rate 0.05
+    python load_test.py --students 10 --base-url http://127.0.0.1:8765/v1   # a mock started separately
+
+Reported at p50/p95/p99: submit latency (click to finished rerun), rerun render time (a rerun with
+no input) and first page load (which includes importing the app in a fresh worker). Throughput is
+reported in submits per second and finished students per minute.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mock_llm_server import MockSettings, serve_mock
+
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+DRAFT_WORDS = (
+    "our organization serves rural families through education programs and community partnerships "
+    "since its founding the center has welcomed thousands of visitors each year and trained local "
+    "volunteers previous grants funded exhibits research and outreach that partners describe as "
+    "essential to the region"
+).split()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile; None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def draft(student, phase, attempt, words=120):
+    rng = random.Random(f"{student}/{phase.name}/{attempt}")
+    if phase.type == "text_input":
+        return f"Organization {student}"
+    return " ".join(rng.choice(DRAFT_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def fill(at, phase, text):
+    #The active phase's field is the last one of its type on the page
+    if phase.type in ("text_input", "text_area"):
+        getattr(at, phase.type)[-1].input(text)
+    elif phase.type in ("radio", "selectbox"):
+        widget = getattr(at, phase.type)[-1]
+        widget.set_value(widget.options[0])
+
+
+#Runs in a worker process; returns that student's Results
+def run_student(student, args):
+    from streamlit.testing.v1 import AppTest
+    from main import get_exercise_registry
+
+    phase_plan = get_exercise_registry().get(args.exercise).phase_plan
+    results = Results()
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    if args.exercise:
+        at.query_params["exercise"] = args.exercise
+    started = time.perf_counter()
+    at.run()
+    results.add("first_loads", time.perf_counter() - started)
+
+    attempts = 0
+    while attempts < args.attempts * len(phase_plan):
+        if at.exception:
+            results.count("exceptions")
+            print(f"Student {student}: {at.exception[0].message}", file=sys.stderr)
+            return results
+        #The app shows the completion message once the final phase has its feedback
+        if phase_plan.final.ai_response_key in at.session_state:
+            results.count("finished")
+            return results
+        phase = phase_plan[at.session_state["CURRENT_PHASE"]]
+        attempts += 1
+        fill(at, phase, draft(student, phase, attempts))
+        started = time.perf_counter()
+        at.button(key=phase.submit_key).click().run()
+        results.add("submits", time.perf_counter() - started)
+        if at.error:
+            results.count("failed_submits")
+
+        started = time.perf_counter()
+        at.run()
+        results.add("reruns", time.perf_counter() - started)
+    results.count("gave_up")
+    return results
+
+
+class Results:
+
+    def __init__(self):
+        self.timings = {"submits": [], "reruns": [], "first_loads": []}
+        self.counts = {"finished": 0, "gave_up": 0, "exceptions": 0, "failed_submits": 0}
+
+    def add(self, kind, seconds):
+        self.timings[kind].append(seconds)
+
+    def count(self, kind):
+        self.counts[kind] += 1
+
+    def merge(self, other):
+        for kind, values in other.timings.items():
+            self.timings[kind].extend(values)
+        for kind, count in other.counts.items():
+            self.counts[kind] += count
+
+    def summary(self, elapsed):
+        report = {"elapsed_seconds": round(elapsed, 2), **self.counts}
+        for kind, values in self.timings.items():
+            report[kind] = {
+                "count": len(values),
+                **{f"p{p}_ms": None if percentile(values, p) is None else round(percentile(values, p) * 1000, 1) for p in (50, 95, 99)},
+            }
+        report["submits_per_second"] = round(len(self.timings["submits"]) / elapsed, 2) if elapsed else None
+        report["students_per_minute"] = round(self.counts["finished"] / elapsed * 60, 2) if elapsed else None
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the app with simulated students.")
+    parser.add_argument("--students", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10, help="Students working at the same time")
+    parser.add_argument("--exercise", default="", help="Exercise in EXERCISES_DIR, instead of config.py")
+    parser.add_argument("--attempts", type=int, default=3, help="Submits allowed per phase before a student gives up")
+    parser.add_argument("--timeout", type=float, default=180, help="Seconds one rerun may take")
+    parser.add_argument("--base-url", default="", help="API to test against instead of a mock started here")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the mock started here")
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--pass-probability", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    mock_state = None
+    if not args.base_url:
+        settings = MockSettings(args.ttft, args.tokens_per_second, args.error_rate,
+                                pass_probability=args.pass_probability, seed=args.seed)
+        _, mock_state = serve_mock(settings, args.port)
+        args.base_url = f"http://127.0.0.1:{args.port}/v1"
+    #Inherited by the workers, and read by the OpenAI client the app builds on its first run
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+
+    results = Results()
+    started = time.perf_counter()
+    #Fresh interpreters rather than forks of this one, which is running the mock's threads
+    context = multiprocessing.get_context("spawn")
+    #Referenced through the module, because AppTest replaces __main__ in the workers with main.py
+    import load_test
+    with ProcessPoolExecutor(max_workers=args.concurrency, mp_context=context) as pool:
+        for student_results in pool.map(load_test.run_student, range(args.students), [args] * args.students):
+            results.merge(student_results)
+    report = results.summary(time.perf_counter() - started)
+    if mock_state:
+        report["mock"] = {"requests": mock_state.requests, "injected_failures": mock_state.injected_failures,
+                          "cancelled": mock_state.cancelled}
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{args.students} students, {args.concurrency} at a time, {report['elapsed_seconds']}s")
+    for kind in ("submits", "reruns", "first_loads"):
+        t = report[kind]
+        print(f"  {kind:<11} n={t['count']:<5} p50 {t['p50_ms']} ms  p95 {t['p95_ms']} ms  p99 {t['p99_ms']} ms")
+    print(f"  throughput {report['submits_per_second']} submits/s, {report['students_per_minute']} finished students/min")
+    print(f"  finished {report['finished']}, gave up {report['gave_up']}, failed submits {report['failed_submits']}, "
+          f"exceptions {report['exceptions']}")
+    if mock_state:
+        print(f"  mock: {report['mock']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
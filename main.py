@@ -1,17 +1,182 @@
+import httpx
 import openai
 import os
+import threading
 from dotenv import find_dotenv, load_dotenv
 import json
 import re
+import time
+import uuid
 import streamlit as st
-from streamlit_extras.stylable_container import stylable_container
-from streamlit_extras.let_it_rain import rain
+import config
 from contextlib import nullcontext
-from openai import OpenAI, AssistantEventHandler
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from config import *
+from response_cache import ResponseCache, response_cache_key
+from metrics import MetricsRegistry, serve_metrics
+from lifecycle import RunRegistry, RunFailed, RunTimeout, retry_stream
+from scoring import ScoreParser
+from prescreen import prescreen
+from analytics import AnalyticsSink
+from assets import AssetCache
+from exercises import ExerciseRegistry, ExerciseNotFound
+from session_store import MemorySessionStore, SQLiteSessionStore, snapshot, restore, load_secret, sign_token, verify_token
+from scheduler import AdmissionScheduler, AdmissionTimeout, FEEDBACK_PRIORITY, SCORING_PRIORITY, estimate_tokens
 
 load_dotenv()
-client = openai.OpenAI()
+
+
+#The client and the resolved assistant are shared by every session in the process, so reruns don't pay for a new connection or an assistants.retrieve round trip.
+#The client's connection pool is sized explicitly, so concurrent sessions reuse open TLS connections instead of each paying for a handshake.
+@st.cache_resource(show_spinner=False)
+def get_client():
+    http_client = openai.DefaultHttpxClient(limits=httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    ))
+    return openai.OpenAI(http_client=http_client)
+
+
+#One entry per exercise's assistant; the least recently used is dropped once EXERCISE_CACHE_SIZE are cached
+@st.cache_resource(ttl=ASSISTANT_CACHE_TTL, max_entries=EXERCISE_CACHE_SIZE, show_spinner=False)
+def get_assistant(assistant_id, model, name, instructions, tools=()):
+    client = get_client()
+    if assistant_id:
+        return client.beta.assistants.retrieve(assistant_id=assistant_id)
+    return create_shared_assistant(model, name, instructions, tools)
+
+
+#An exercise without an ASSISTANT_ID gets one assistant per process. Cached without expiry or eviction, so a refresh
+#of get_assistant() returns the same assistant instead of creating another one on the account.
+@st.cache_resource(show_spinner=False)
+def create_shared_assistant(model, name, instructions, tools=()):
+    assistant_obj = get_client().beta.assistants.create(
+        name=name, instructions=instructions, tools=list(tools), model=model
+    )
+    print(f"AssisID:::: {assistant_obj.id}")
+    return assistant_obj
+
+
+def warm_up():
+    started = time.perf_counter()
+    try:
+        #Without an ASSISTANT_ID the first session creates the assistant, so only the connection is warmed
+        if LLM_BACKEND == "chat" or not ASSISTANT_ID:
+            get_client().models.retrieve(OPENAI_MODEL)
+        else:
+            get_assistant(ASSISTANT_ID, OPENAI_MODEL, ASSISTANT_NAME, ASSISTANT_INSTRUCTIONS)
+    except Exception as e:
+        #The first student's request will simply open the connection itself
+        print(f"Warm-up failed::: {e}")
+        return
+    print(f"Warm-up took::: {time.perf_counter() - started:.2f}s")
+
+
+#Started by the first script run in the process, so the handshake and the assistant lookup overlap with drawing the page
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+#Scoring runs ask for structured output so the score can be parsed as it streams
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+#Lets an asset-grounded run search the SHARED_ASSET attached to its thread
+FILE_SEARCH_TOOLS = [{"type": "file_search"}]
+
+
+#Shared by all sessions; scoring runs are short, so a small pool is enough
+@st.cache_resource
+def get_scoring_executor():
+    return ThreadPoolExecutor(max_workers=SCORING_WORKERS, thread_name_prefix="scoring")
+
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_DIR, RESPONSE_CACHE_DISK_BYTES)
+
+
+@st.cache_resource
+def get_metrics():
+    registry = MetricsRegistry(METRICS_JSONL_PATH)
+    if METRICS_PORT:
+        try:
+            serve_metrics(registry, METRICS_PORT)
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
+    return registry
+
+
+#Record to the process-wide registry and keep a copy for this session's debug panel
+def record_metric(kind, phase_name, model, **fields):
+    record = get_metrics().record(kind, phase_name, model, **fields)
+    if "metrics" not in st.session_state:
+        st.session_state.metrics = []
+    st.session_state.metrics.append(record)
+
+
+def metrics_sidebar():
+    with st.sidebar:
+        st.subheader("Session metrics")
+        if st.session_state.get("metrics"):
+            st.dataframe(st.session_state.metrics, hide_index=True)
+        else:
+            st.caption("No runs yet.")
+
+
+#Shared by every session, so the configured rate limits hold for the whole process
+@st.cache_resource
+def get_scheduler():
+    #Each process has its own scheduler, so together they stay within the account's limits
+    return AdmissionScheduler(RATE_LIMIT_RPM / WORKER_PROCESSES, RATE_LIMIT_TPM / WORKER_PROCESSES)
+
+
+#Runs in flight for every session, so superseded and abandoned ones can be cancelled
+@st.cache_resource
+def get_run_registry():
+    registry = RunRegistry()
+    get_metrics().add_collector("runs", registry.stats)
+    return registry
+
+
+#Session progress shared by every worker process, so a student can resume on any of them
+@st.cache_resource
+def get_session_store():
+    if SESSION_BACKEND == "sqlite":
+        store = SQLiteSessionStore(SESSION_DB_PATH, SESSION_FLUSH_SECONDS, SESSION_BATCH_SIZE, SESSION_TTL_SECONDS)
+    else:
+        store = MemorySessionStore()
+    get_metrics().add_collector("sessions", store.stats)
+    return store
+
+
+#Signs the resume tokens put in the URL
+@st.cache_resource
+def get_session_secret():
+    return load_secret(SESSION_SECRET_PATH)
+
+
+#Queue this session's record for the store, only when something changed since it was last saved
+def save_session():
+    record = snapshot(st.session_state, current_exercise().phase_plan)
+    if record != st.session_state.get("saved_record"):
+        get_session_store().save(st.session_state.session_token, record)
+        st.session_state.saved_record = record
+
+
+#Give up on this submit. The queued messages are dropped so submitting again doesn't send them twice.
+def stop_failed(openai_assistant, message):
+    openai_assistant.take_pending_messages()
+    st.error(message, icon="🚨")
+    st.stop()
+
+
+def stop_busy(openai_assistant):
+    stop_failed(openai_assistant, "The feedback service is very busy right now. Please wait a minute and submit again.")
+
 
 function_map = {
     "text_input": st.text_input,
@@ -23,183 +188,658 @@ function_map = {
     "selectbox": st.selectbox
 }
 
-user_input = {}
-
-def build_field(i, phases_dict):
-
-    phase_name = list(phases_dict.keys())[i]
-    phase_dict = list(phases_dict.values())[i]
-    field_type = phase_dict.get("type","")
-    field_label = phase_dict.get("label","")
-    field_body = phase_dict.get("body","")
-    field_value = phase_dict.get("value","")
-    field_max_chars = phase_dict.get("max_chars",None)
-    field_help = phase_dict.get("help","")
-    field_on_click = phase_dict.get("on_click",None)
-    field_options = phase_dict.get("options",[])
-    field_horizontal = phase_dict.get("horizontal",False)
-    field_height = phase_dict.get("height",None)
-    field_unsafe_html = phase_dict.get("unsafe_allow_html", False)
-    field_placeholder = phase_dict.get("placeholder","")
-
-    kwargs = {}
-    if field_label:
-        kwargs['label'] = field_label
-    if field_body:
-        kwargs['body'] = field_body
-    if field_value:
-        kwargs['value'] = field_value
-    if field_options:
-        kwargs['options'] = field_options
-    if field_max_chars:
-        kwargs['max_chars'] = field_max_chars
-    if field_help:
-        kwargs['help'] = field_help
-    if field_on_click:
-        kwargs['on_click'] = field_on_click
-    if field_horizontal:
-        kwargs['horizontal'] = field_horizontal
-    if field_height:
-        kwargs['height'] = field_height
-    if field_unsafe_html:
-        kwargs['unsafe_allow_html'] = field_unsafe_html
-    if field_placeholder:
-        kwargs['placeholder'] = field_placeholder
- 
-    key = f"{phase_name}_phase_status"
-    
+LARGE_LABEL_CSS = """
+    <style>
+        label p {
+            font-weight: bold;
+            font-size: 28px;
+        }
+    </style>
+    """
+
+def build_field(phase):
+
+    kwargs = dict(phase.widget_kwargs)
+
     #If the user has already answered this question:
-    if key in st.session_state and st.session_state[key]:
+    if st.session_state.get(phase.status_key):
         #Write their answer
-        if f"{phase_name}_user_input" in st.session_state:
-            if field_type != "selectbox":
-                kwargs['value'] = st.session_state[f"{phase_name}_user_input"]
+        if phase.user_input_key in st.session_state:
+            if phase.type != "selectbox":
+                kwargs['value'] = st.session_state[phase.user_input_key]
             kwargs['disabled'] = True
 
-    my_input_function = function_map[field_type]
-
-    with stylable_container(
-        key=f"large_label_{phase_name}_{field_label}",
-        css_styles="""
-            label p {
-                font-weight: bold;
-                font-size: 28px;
-            }
-            """,
-    ):
+    my_input_function = function_map[phase.type]
 
-        user_input[phase_name] = my_input_function(**kwargs)
+    return my_input_function(**kwargs)
 
 
 class AssistantManager:
-    assistant_id = ASSISTANT_ID
-    thread_id = ASSISTANT_THREAD
     
-    def __init__(self, model: str = OPENAI_MODEL):
-        self.client = client
-        self.model = OPENAI_MODEL
+    def __init__(self, exercise):
+        self.client = get_client()
+        self.exercise = exercise
+        self.model = exercise.OPENAI_MODEL
+        self.assistant_id = exercise.ASSISTANT_ID
         self.assistant = None
         self.thread = None
         self.run = None
+        #File ids attached to the messages the next run is sent with
+        self.sent_file_ids = []
         self.summary = None
+        self.response_cache = get_response_cache()
+        self.round_trips = 0
+        self.scheduler = get_scheduler()
+        self.run_registry = get_run_registry()
+        self.metrics = get_metrics()
+        self.session_token = st.session_state.get("session_token", "")
+
+        self.backend = LLM_BACKEND
 
-        # Retrieve existing assistant and thread if IDs are already set
-        if AssistantManager.assistant_id:
-            self.assistant = self.client.beta.assistants.retrieve(
-                assistant_id=AssistantManager.assistant_id
+        # Retrieve existing assistant and thread if IDs are already set. Both come from caches, so a rerun makes no API calls.
+        # The chat backend is stateless and needs neither.
+        if self.backend == "chat":
+            return
+        if self.assistant_id:
+            self.assistant = get_assistant(
+                self.assistant_id, self.model, exercise.ASSISTANT_NAME, exercise.ASSISTANT_INSTRUCTIONS
             )
-        if AssistantManager.thread_id:
+        #A resumed session only has its thread's id, so the thread is retrieved once
+        thread_id = st.session_state.get("thread_id") or exercise.ASSISTANT_THREAD
+        if st.session_state.get("thread_obj"):
+            self.thread = st.session_state.thread_obj
+        elif thread_id:
             self.thread = self.client.beta.threads.retrieve(
-                thread_id=AssistantManager.thread_id
+                thread_id=thread_id
             )
+            st.session_state.thread_obj = self.thread
 
     def create_assistant(self, name, instructions, tools):
-        if not self.assistant:
-            assistant_obj = self.client.beta.assistants.create(
-                name=name, instructions=instructions, tools=tools, model=self.model
-            )
-            AssistantManager.assistant_id = assistant_obj.id
-            self.assistant = assistant_obj
-            print(f"AssisID:::: {self.assistant.id}")
-
-    def create_thread(self):
-        if not self.thread:
-            if st.session_state.thread_obj:
-                print(f"Grabbing existing thread...")
-                thread_obj = st.session_state.thread_obj
-            else:
-                print(f"Creating and saving new thread")
-                thread_obj = self.client.beta.threads.create()
-                st.session_state.thread_obj = thread_obj
+        if not self.assistant and self.backend != "chat":
+            self.assistant = get_assistant("", self.model, name, instructions, tuple(tools))
+            self.assistant_id = self.assistant.id
+
+    # Queue a MESSAGE for our thread. Indicate if the message is from the user or assistant.
+    # Queued messages are sent with the next run in the same request, instead of one request per message.
+    def add_message_to_thread(self, role, content, attachments=None):
+        if self.backend == "chat":
+            return
+        if "pending_messages" not in st.session_state:
+            st.session_state.pending_messages = []
+        message = {"role": role, "content": content}
+        if attachments:
+            message["attachments"] = attachments
+        st.session_state.pending_messages.append(message)
 
-            AssistantManager.thread_id = thread_obj.id
-            self.thread = thread_obj
+    # The uploaded SHARED_ASSET, attached to an asset-grounded phase's message. The file stays searchable on the thread,
+    # so it is only attached the first time.
+    def asset_attachments(self, phase):
+        if self.backend == "chat" or not phase.get("asset_grounded"):
+            return None
+        file_id = shared_asset_file_id(self.exercise, "assistants")
+        if not file_id or st.session_state.get("asset_file_id") == file_id:
+            return None
+        #Recorded by track_stream_object once a run has carried it onto the thread; until then each submit attaches it again
+        return [{"file_id": file_id, "tools": FILE_SEARCH_TOOLS}]
+
+    def take_pending_messages(self):
+        messages = st.session_state.get("pending_messages", [])
+        st.session_state.pending_messages = []
+        return messages
+
+    # Called with each thread/run object seen on a stream. The first run creates the thread, so this is where we learn its id.
+    def track_stream_object(self, obj):
+        if obj.object == "thread":
+            self.thread = obj
+            st.session_state.thread_obj = obj
             print(f"ThreadID::: {self.thread.id}")
-        else:
-            print(f"A thread already exists: {self.thread.id}")
-
-    # Create a MESSAGE within our thread. Indicate if the message is from the user or assistant.
-    def add_message_to_thread(self, role, content):
-        if self.thread:
-            self.client.beta.threads.messages.create(
-                thread_id=self.thread.id, 
-                role=role, 
-                content=content
-            )
+        elif obj.object == "thread.run":
+            if self.run is None:
+                client, thread_id, run_id = self.client, obj.thread_id, obj.id
+                self.run_registry.update(self.run_key, self.run_handle, lambda: cancel_run(client, thread_id, run_id))
+                #The run exists, so the messages it was sent with, and their attachments, are on the thread
+                for file_id in self.sent_file_ids:
+                    st.session_state.asset_file_id = file_id
+                self.sent_file_ids = []
+            self.run = obj
+
+    def on_retry(self, phase_name):
+        def retried(attempt, error):
+            print(f"Retrying run (attempt {attempt})::: {error}")
+            self.run_registry.record_retry()
+            self.metrics.record("retry", phase_name, self.model, error=str(error))
+        return retried
 
     # Create a RUN that sends the thread (with our messages) to the ASSISTANT
-    def run_assistant(self, instructions, current_phase, scoring_run=False, temperature = TEMPERATURE, response_format="auto"):
-        if self.thread and self.assistant:
+    # The phase's feedback or scoring route picks the model, completion limit and sampling; route= overrides it, e.g. for a fallback.
+    def run_assistant(self, instructions, current_phase, scoring_run=False, response_format="auto", route=None):
+        if self.assistant or self.backend == "chat":
+            phase = self.exercise.phase_plan[current_phase]
+            if route is None:
+                route = phase.scoring_route if scoring_run else phase.feedback_route
 
             # Create a RUN that sends the thread (with our messages) to the ASSISTANT
-            if not scoring_run or (scoring_run and SCORING_DEBUG_MODE):
+            res_box = None
+            prefix = ""
+            if not scoring_run:
                 res_box = st.info(body="", icon="🤖")
-            report = []
-
-            stream = self.client.beta.threads.runs.create(
-                assistant_id=self.assistant.id,
-                thread_id=self.thread.id,
-                instructions=instructions,
-                temperature=temperature,
-                stream=True
-                )
+            elif self.exercise.SCORING_DEBUG_MODE:
+                res_box = st.info(body="", icon="🤖")
+                prefix = "SCORE (DEBUG MODE): "
+            renderer = StreamRenderer(res_box, prefix)
+
+            cache_key = self.response_cache_key(current_phase, "score" if scoring_run else "feedback", route)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                #Put the cached answer on the thread so later phases still see it
+                self.add_message_to_thread(role="assistant", content=cached)
+                renderer.add(cached)
+                result = renderer.finish()
+                print(f"Response cache hit::: {self.response_cache.stats()}")
+                record_metric("score" if scoring_run else "feedback", current_phase, route.model, cached=True,
+                    **route_fields(route), **renderer.stats())
+                if scoring_run == False:
+                    st_store(result,current_phase,"ai_response")
+                else:
+                    store_score(result, current_phase)
+                return
 
             context_manager = st.spinner('Checking Score...') if scoring_run else nullcontext()
 
+            stats = {}
+            priority = SCORING_PRIORITY if scoring_run else FEEDBACK_PRIORITY
+            response_format = JSON_RESPONSE_FORMAT if response_format == "json" else openai.NOT_GIVEN
+            #An asset-grounded feedback run searches the attached SHARED_ASSET
+            grounded = phase.get("asset_grounded") and not scoring_run and self.backend != "chat"
+            tools = FILE_SEARCH_TOOLS if grounded and shared_asset_file_id(self.exercise, "assistants") else openai.NOT_GIVEN
+            #Without debug output nobody reads the rest of the scores once pass/fail is certain, so the run can stop there
+            parser = ScoreParser(phase.criteria, phase.minimum_score) if scoring_run and not self.exercise.SCORING_DEBUG_MODE else None
+            deadline = phase.get("deadline_seconds", RUN_DEADLINE_SECONDS)
+            self.run = None
             with context_manager:
-                for event in stream:
-                    if event.data.object == "thread.message.delta":
-                        #Iterate over content in the delta
-                        for content in event.data.delta.content:
-                            if content.type == 'text':
-                                #Print the value field from text deltas
-                                report.append(content.text.value)
-                                result = "".join(report).strip()
-                                if scoring_run == False:
-                                    res_box.info(body=f'{result}', icon="🤖")
-                                if scoring_run and SCORING_DEBUG_MODE:
-                                    res_box.info(body=f'SCORE (DEBUG MODE): {result}', icon="🤖")
+                if self.backend == "chat":
+                    submission = st.session_state.get(phase.user_input_key, "")
+                    if scoring_run:
+                        messages = build_chat_scoring_messages(phase.rubric, submission, self.exercise.ASSISTANT_INSTRUCTIONS)
+                    else:
+                        messages = build_chat_messages(self.exercise, phase, submission)
+                    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages if isinstance(message["content"], str))
+                    admitted_tokens = self.admit_or_stop(prompt_tokens, route, priority, res_box)
+
+                    def open_deltas(attempt):
+                        self.round_trips += 1
+                        stream = self.client.chat.completions.create(
+                            messages=messages,
+                            response_format=response_format,
+                            **route_options(route),
+                            stream=True,
+                            stream_options={"include_usage": True},
+                            timeout=RUN_READ_TIMEOUT
+                            )
+                        #Closing a chat stream stops the generation
+                        self.run_registry.update(self.run_key, self.run_handle, stream.close)
+                        return chat_stream_text(stream, stats)
+                else:
+                    pending_messages = self.take_pending_messages()
+                    self.sent_file_ids = [attachment["file_id"] for message in pending_messages
+                                          for attachment in message.get("attachments", [])]
+                    #A run reads the whole thread, so the estimate covers everything sent on it so far
+                    st.session_state.thread_tokens = st.session_state.get("thread_tokens", 0) + sum(
+                        estimate_tokens(message["content"]) for message in pending_messages
+                    )
+                    admitted_tokens = self.admit_or_stop(st.session_state.thread_tokens, route, priority, res_box)
+
+                    def open_deltas(attempt):
+                        self.round_trips += 1
+                        #Once a run has been created its messages are on the thread, so a retry must not send them again
+                        messages = pending_messages if self.run is None else []
+                        if self.thread:
+                            stream = self.client.beta.threads.runs.create(
+                                assistant_id=self.assistant.id,
+                                thread_id=self.thread.id,
+                                additional_messages=messages or None,
+                                instructions=instructions,
+                                response_format=response_format,
+                                tools=tools,
+                                **route_options(route),
+                                stream=True,
+                                timeout=RUN_READ_TIMEOUT
+                                )
+                        else:
+                            #No thread yet: create it, with the queued messages, in the same request as the run
+                            stream = self.client.beta.threads.create_and_run(
+                                assistant_id=self.assistant.id,
+                                thread={"messages": messages},
+                                instructions=instructions,
+                                response_format=response_format,
+                                tools=tools,
+                                **route_options(route),
+                                stream=True,
+                                timeout=RUN_READ_TIMEOUT
+                                )
+                        return assistant_stream_text(stream, self.track_stream_object, stats)
 
+                self.run_key = (self.session_token, "score" if scoring_run else "feedback")
+                self.run_handle = self.run_registry.start(self.run_key, deadline)
+                #The deadline runs from here, after admission, so time spent waiting in the queue isn't held against the run
+                run_started = time.perf_counter()
+                finished = False
+                decided_early = False
+                deltas = retry_stream(open_deltas, RUN_RETRIES, RUN_RETRY_DELAY, self.on_retry(current_phase))
+                try:
+                    for text in deltas:
+                        renderer.add(text)
+                        if parser and parser.feed(text):
+                            decided_early = True
+                            break
+                        if time.perf_counter() - run_started > deadline:
+                            self.run_registry.record_timeout()
+                            raise RunTimeout(f"{current_phase} run passed its {deadline} second deadline")
+                    result = renderer.finish()
+                    finished = True
+                except (RunTimeout, RunFailed, openai.APIError) as e:
+                    print(f"Run failed::: {e}")
+                    stop_failed(self, "The AI didn't finish responding. Please submit again.")
+                finally:
+                    #Anything that ends the stream early, including a decided score, a rerun or a closed session, cancels the run
+                    deltas.close()
+                    self.run_registry.finish(self.run_key, self.run_handle, cancel=not finished or decided_early)
+            stats.update(renderer.stats())
+            stats["decided_early"] = decided_early
+            if "prompt_tokens" in stats:
+                self.scheduler.settle(admitted_tokens, stats["prompt_tokens"] + stats["completion_tokens"])
+            if self.backend != "chat":
+                st.session_state.thread_tokens += estimate_tokens(result)
+            print(f"Stream stats::: {stats}")
+            record_metric("score" if scoring_run else "feedback", current_phase, route.model, cached=False,
+                **route_fields(route), **stats)
+            if cache_key:
+                self.response_cache.put(cache_key, result)
 
             if scoring_run == False:
                 st_store(result,current_phase,"ai_response")
             else:
-                st_store(result,current_phase,"ai_result")
-                score = extract_score(result)
-                st_store(score,current_phase,"ai_score")
+                store_score(result, current_phase)
+
+    # Score a submission on its own thread, created and run in one request, so it can run alongside the feedback run.
+    # This runs off the Streamlit script thread, so it must not touch st.* and only returns the raw scoring text.
+    # Output the scoring route can't be read is scored again on the fallback route. Each run's route and stats
+    # (timings, token usage) end up in self.scoring_runs for the caller to record once the result is joined.
+    # cancelled is the submit's own event: abandon_scoring sets it, and a run that hasn't started yet then never starts.
+    def score_submission(self, phase_name, submission, cancelled):
+        phase = self.exercise.phase_plan[phase_name]
+        self.scoring_runs = []
+        result = self.score_on_route(phase, submission, phase.scoring_route, cancelled)
+        fallback = self.fallback_route(phase)
+        #A readable score has an outcome, even when the run stopped before the last criterion
+        if fallback and parse_score(result, phase)[1] is None:
+            print(f"Unreadable score from {phase.scoring_route.model}, scoring again on {fallback.model}")
+            result = self.score_on_route(phase, submission, fallback, cancelled)
+        return result
+
+    def score_on_route(self, phase, submission, route, cancelled):
+        started = time.perf_counter()
+        stats = {"cached": True}
+        self.scoring_runs.append((route, stats))
+        cache_key = self.response_cache_key(phase.name, "score", route, submission)
+        cached = self.response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            stats["seconds"] = time.perf_counter() - started
+            return cached
+        admitted_tokens = self.admit(estimate_tokens(submission) + estimate_tokens(phase.scoring_instructions), route, SCORING_PRIORITY)
+        if cancelled.is_set():
+            self.scheduler.settle(admitted_tokens, 0)
+            raise RunFailed("abandoned", "the submit was given up before scoring started")
+        self.round_trips += 1
+        stats["cached"] = False
+        run_key = (self.session_token, "concurrent score")
+        run_handle = self.run_registry.start(run_key, phase.get("deadline_seconds", RUN_DEADLINE_SECONDS))
+        on_cancel = lambda cancel: self.run_registry.update(run_key, run_handle, cancel)
+        parser = ScoreParser(phase.criteria, phase.minimum_score) if not self.exercise.SCORING_DEBUG_MODE else None
+        finished = False
+        try:
+            if self.backend == "chat":
+                result = chat_score_submission(self.client, route, phase.rubric, submission,
+                    instructions=self.exercise.ASSISTANT_INSTRUCTIONS, stats=stats, on_cancel=on_cancel, on_retry=self.on_retry(phase.name), parser=parser)
+            else:
+                result = score_submission(self.client, self.assistant.id, phase.rubric, submission, route,
+                    stats=stats, on_cancel=on_cancel, on_retry=self.on_retry(phase.name), parser=parser)
+            finished = True
+        finally:
+            decided_early = stats.get("decided_early", False)
+            self.run_registry.finish(run_key, run_handle, cancel=not finished or decided_early)
+        if "prompt_tokens" in stats:
+            self.scheduler.settle(admitted_tokens, stats["prompt_tokens"] + stats["completion_tokens"])
+        if cache_key:
+            self.response_cache.put(cache_key, result)
+        return result
+
+    # Give up on concurrent scoring: a queued task never starts, and a running one is cancelled instead of spending tokens
+    def abandon_scoring(self, future, cancelled):
+        cancelled.set()
+        future.cancel()
+        self.run_registry.cancel((self.session_token, "concurrent score"))
+
+    # The route to score on again when the scoring route's output can't be read, if SCORING_FALLBACK allows one
+    def fallback_route(self, phase):
+        return phase.fallback_route if SCORING_FALLBACK else None
+
+    # Wait for the process-wide scheduler to admit a run of about this many prompt tokens, plus room for the completion.
+    # If a status box is given, the student sees their place in the queue while waiting. Returns the tokens reserved.
+    def admit(self, prompt_tokens, route, priority, status_box=None):
+        tokens = prompt_tokens + (route.max_tokens or MAX_TOKENS)
+        on_wait = None
+        if status_box is not None:
+            on_wait = lambda position: status_box.info(
+                f"Lots of students are submitting right now. You are number {position} in line...", icon="⏳"
+            )
+        self.scheduler.admit(tokens, priority, ADMISSION_TIMEOUT, on_wait)
+        return tokens
+
+    def admit_or_stop(self, prompt_tokens, route, priority, status_box=None):
+        try:
+            return self.admit(prompt_tokens, route, priority, status_box)
+        except AdmissionTimeout:
+            stop_busy(self)
+
+    # Only phases with "cache_responses" get a key. The earlier phases' inputs and feedback that the run reads are part of it:
+    # the phase's context_phases on the chat backend, and everything said before it on the Assistants thread.
+    # Scoring on its own thread passes the submission and reads nothing else.
+    def response_cache_key(self, phase_name, kind, route, submission=None):
+        phase = self.exercise.phase_plan[phase_name]
+        if not phase.get("cache_responses", False):
+            return None
+        context = []
+        if submission is None:
+            submission = st.session_state.get(phase.user_input_key, "")
+            if self.backend == "chat":
+                priors = [self.exercise.phase_plan[name] for name in phase.context_phases]
+            else:
+                priors = self.exercise.phase_plan.phases[:phase.index]
+            for prior in priors:
+                context.append([st.session_state.get(prior.user_input_key), st.session_state.get(prior.ai_response_key)])
+        instructions = self.exercise.ASSISTANT_INSTRUCTIONS + phase.instructions
+        return response_cache_key(phase_name, kind, instructions, phase.rubric, route.model, route.temperature, submission, context)
+
+
+# on_cancel, if given, is called with a function that cancels the run, as soon as one is available.
+# Transient failures are retried before any text arrives; a fresh thread is created for each attempt.
+# With a ScoreParser, reading stops as soon as pass/fail is decided; the caller should then cancel the run.
+def score_submission(client, assistant_id, rubric, submission, route, stats=None, on_cancel=None, on_retry=None, parser=None):
+    def on_object(obj):
+        if on_cancel and obj.object == "thread.run":
+            on_cancel(lambda: cancel_run(client, obj.thread_id, obj.id))
+
+    def open_deltas(attempt):
+        stream = client.beta.threads.create_and_run(
+            assistant_id=assistant_id,
+            thread={"messages": [
+                {"role": "user", "content": submission},
+                {"role": "assistant", "content": build_scoring_instructions(rubric)},
+            ]},
+            response_format=JSON_RESPONSE_FORMAT,
+            **route_options(route),
+            stream=True,
+            timeout=RUN_READ_TIMEOUT
+            )
+        return assistant_stream_text(stream, on_object, stats)
+    return collect_scoring_text(retry_stream(open_deltas, RUN_RETRIES, RUN_RETRY_DELAY, on_retry), stats, parser)
+
+
+def chat_score_submission(client, route, rubric, submission, instructions=ASSISTANT_INSTRUCTIONS, stats=None, on_cancel=None, on_retry=None, parser=None):
+    def open_deltas(attempt):
+        stream = client.chat.completions.create(
+            messages=build_chat_scoring_messages(rubric, submission, instructions),
+            response_format=JSON_RESPONSE_FORMAT,
+            **route_options(route),
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=RUN_READ_TIMEOUT
+            )
+        if on_cancel:
+            on_cancel(stream.close)
+        return chat_stream_text(stream, stats)
+    return collect_scoring_text(retry_stream(open_deltas, RUN_RETRIES, RUN_RETRY_DELAY, on_retry), stats, parser)
+
+
+#Cancel a run and wait briefly for it to stop, so the thread is unlocked for the next run
+def cancel_run(client, thread_id, run_id, wait_seconds=5):
+    run = client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+    deadline = time.monotonic() + wait_seconds
+    while run.status in ("queued", "in_progress", "cancelling") and time.monotonic() < deadline:
+        time.sleep(0.25)
+        run = client.beta.threads.runs.retrieve(run_id=run_id, thread_id=thread_id)
+    print(f"Cancelled run {run_id}::: {run.status}")
+
+
+def collect_scoring_text(deltas, stats=None, parser=None):
+    renderer = StreamRenderer(None)
+    decided_early = False
+    for text in deltas:
+        renderer.add(text)
+        if parser and parser.feed(text):
+            decided_early = True
+            break
+    deltas.close()
+    result = renderer.finish()
+    if stats is not None:
+        stats.update(renderer.stats())
+        stats["decided_early"] = decided_early
+    print(f"Scoring stream stats::: {renderer.stats()}")
+    return result
+
+
+#The request settings a route sets, in the names both the chat and the Assistants APIs take. Unset ones are left to the API.
+def route_options(route):
+    options = {"model": route.model, "max_completion_tokens": route.max_tokens, "temperature": route.temperature, "top_p": route.top_p}
+    return {name: openai.NOT_GIVEN if value is None else value for name, value in options.items()}
+
+
+#Metric fields recording which route a run took, so tiers can be compared
+def route_fields(route):
+    return {"route": route.kind, "fallback_from": route.fallback_from or None}
+
+
+def usage_stats(usage):
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+#Yield the text deltas from an Assistants run stream, handing thread and run objects to on_object.
+#Token usage from the completed run is written into stats. A failed run raises RunFailed.
+def assistant_stream_text(stream, on_object=None, stats=None):
+    for event in stream:
+        if event.data.object in ("thread", "thread.run"):
+            if on_object:
+                on_object(event.data)
+            if stats is not None and getattr(event.data, "usage", None):
+                stats.update(usage_stats(event.data.usage))
+            if event.event == "thread.run.failed":
+                error = event.data.last_error
+                raise RunFailed(error.code if error else "failed", error.message if error else "")
+        elif event.data.object == "thread.message.delta":
+            #Iterate over content in the delta
+            for content in event.data.delta.content:
+                if content.type == 'text':
+                    yield content.text.value
+
+
+#Yield the text deltas from a chat completions stream. Token usage from the last chunk is written into stats.
+def chat_stream_text(stream, stats=None):
+    for chunk in stream:
+        if chunk.usage and stats is not None:
+            stats.update(usage_stats(chunk.usage))
+        for choice in chunk.choices:
+            if choice.delta.content:
+                yield choice.delta.content
 
 
+# A chat request holds the system prompt, the phase's declared context_phases (their answers and feedback), the phase instructions and the submission.
+# Nothing else from the session is resent, so the request size doesn't grow as the student moves through phases.
+def build_chat_messages(exercise, phase, submission):
+    messages = [{"role": "system", "content": exercise.ASSISTANT_INSTRUCTIONS}]
+    for name in phase.context_phases:
+        prior = exercise.phase_plan[name]
+        if prior.user_input_key in st.session_state:
+            messages.append({"role": "user", "content": st.session_state[prior.user_input_key]})
+        if prior.ai_response_key in st.session_state:
+            messages.append({"role": "assistant", "content": st.session_state[prior.ai_response_key]})
+    if phase.instructions:
+        messages.append({"role": "system", "content": phase.instructions})
+    #An asset-grounded phase points at the uploaded SHARED_ASSET instead of carrying its text
+    file_id = shared_asset_file_id(exercise, "user_data") if phase.get("asset_grounded") else None
+    if file_id:
+        messages.append({"role": "user", "content": [{"type": "file", "file": {"file_id": file_id}}]})
+    messages.append({"role": "user", "content": submission})
+    return messages
+
+
+def build_chat_scoring_messages(rubric, submission, instructions=ASSISTANT_INSTRUCTIONS):
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": submission},
+        {"role": "system", "content": build_scoring_instructions(rubric)},
+    ]
+
+
+class StreamRenderer:
+    """Buffers streamed text deltas and redraws the response box at most once per frame.
+
+    A frame is drawn when STREAM_FRAME_SECONDS have passed or STREAM_FRAME_CHARS new
+    characters have arrived since the last draw. finish() always draws the final text.
+    """
+
+    def __init__(self, res_box, prefix="", frame_seconds=STREAM_FRAME_SECONDS, frame_chars=STREAM_FRAME_CHARS):
+        self.res_box = res_box
+        self.prefix = prefix
+        self.frame_seconds = frame_seconds
+        self.frame_chars = frame_chars
+        self.chunks = []
+        self.pending_chars = 0
+        self.delta_count = 0
+        self.render_count = 0
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.last_render_at = self.started
+
+    def add(self, text):
+        if not text:
+            return
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.chunks.append(text)
+        self.delta_count += 1
+        self.pending_chars += len(text)
+        if self.pending_chars >= self.frame_chars or now - self.last_render_at >= self.frame_seconds:
+            self.render(now)
+
+    def text(self):
+        #Collapse the buffer so each character is only joined once per frame
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    def render(self, now=None):
+        self.pending_chars = 0
+        self.last_render_at = now or time.perf_counter()
+        if self.res_box is not None:
+            self.res_box.info(body=f'{self.prefix}{self.text().strip()}', icon="🤖")
+            self.render_count += 1
+
+    def finish(self):
+        if self.pending_chars or self.render_count == 0:
+            self.render()
+        return self.text().strip()
+
+    def stats(self):
+        ttft = None if self.first_token_at is None else self.first_token_at - self.started
+        return {
+            "time_to_first_token": ttft,
+            "seconds": time.perf_counter() - self.started,
+            "deltas": self.delta_count,
+            "renders": self.render_count,
+            "chars": len(self.text()),
+        }
 
 
 def st_store(input, phase_name, phase_key):
     key = f"{phase_name}_{phase_key}"
     st.session_state[key] = input
+    #An unscored phase is finished once its feedback is stored; scored phases are recorded by check_score
+    if phase_key == "ai_response":
+        phase = current_exercise().phase_plan[phase_name]
+        if not phase.scored:
+            record_submission(phase)
+
+
+#Instructor analytics, written behind the submit path. None when ANALYTICS_DIR is "".
+@st.cache_resource
+def get_analytics():
+    if not ANALYTICS_DIR:
+        return None
+    sink = AnalyticsSink(ANALYTICS_DIR, ANALYTICS_QUEUE_SIZE, ANALYTICS_BATCH_SIZE, ANALYTICS_FLUSH_SECONDS,
+        ANALYTICS_FILE_RECORDS, ANALYTICS_BLOCK_SECONDS, ANALYTICS_WHEN_FULL)
+    get_metrics().add_collector("analytics", sink.stats)
+    return sink
+
+
+#Queue one record per finished submission: the text, the feedback, the scores and the outcome
+def record_submission(phase, passed=None, skipped=False):
+    sink = get_analytics()
+    if sink is None:
+        return
+    result = st.session_state.get(phase.ai_result_key) if phase.scored else None
+    sink.emit({
+        "session": st.session_state.get("session_token", ""),
+        "exercise": current_exercise().name,
+        "phase": phase.name,
+        "submission": st.session_state.get(phase.user_input_key),
+        "feedback": st.session_state.get(phase.ai_response_key),
+        "result": result,
+        #A run stopped as soon as pass/fail was certain only read some criteria, so its scores stay out of the distributions
+        "criteria": criterion_scores(result, phase) if result and st.session_state.get(phase.ai_score_key) is not None else None,
+        "score": st.session_state.get(phase.ai_score_key) if phase.scored else None,
+        "partial": passed is not None and st.session_state.get(phase.ai_score_key) is None,
+        "minimum_score": phase.minimum_score,
+        "passed": passed,
+        "skipped": skipped,
+    })
+
+
+def criterion_scores(result, phase):
+    parser = ScoreParser(phase.criteria, phase.minimum_score)
+    parser.feed(result)
+    return {phase.criteria[i][0]: points for i, points in sorted(parser.scores.items())}
         
 
+def store_score(result, phase_name):
+    st_store(result,phase_name,"ai_result")
+    score, passed = parse_score(result, current_exercise().phase_plan[phase_name])
+    st_store(score,phase_name,"ai_score")
+    st_store(passed,phase_name,"ai_passed")
+
+
+# Validate each criterion against the rubric's points and add them up locally. The model's own total is only used
+# when the rubric has no per-criterion points. Returns (score, passed): score is None, not 0, when the output can't be
+# read or the run stopped as soon as pass/fail was certain; passed is None only when the output can't be read.
+def parse_score(result, phase):
+    parser = ScoreParser(phase.criteria, phase.minimum_score)
+    parser.feed(result)
+    if parser.errors:
+        print(f"Score validation::: {parser.errors}")
+    if phase.criteria:
+        #Only the criteria count. Invalid or missing ones leave the outcome unread, for the fallback route or a new submit.
+        return parser.final_score(), parser.passed if parser.decided else None
+    score = parser.final_score()
+    if score is None:
+        score = extract_score(result)
+    return score, None if score is None else score >= phase.minimum_score
+
+
 def build_scoring_instructions(rubric):
     scoring_instructions = """Please score the user's previous response based on the following rubric: \n """
     scoring_instructions += rubric
-    scoring_instructions += """\n\nPlease output your response as JSON, using this format: { "[criteria 1]": "[score 1]", "[criteria 2]": "[score 2]", "total": "[total score]" }"""
+    scoring_instructions += """\n\nPlease output your response as a JSON object, using each criterion's name from the rubric as a key and its points as a number, in rubric order: { "[criteria 1]": [score 1], "[criteria 2]": [score 2], "total": [total score] }"""
     return scoring_instructions
 
 def extract_score(text):
@@ -214,30 +854,120 @@ def extract_score(text):
     if match:
         return int(match.group(1))
     else:
-        return 0
+        return None
 
 
-def check_score(PHASE_NAME):
-    score = st.session_state[f"{PHASE_NAME}_ai_score"]
+#Every exercise this process serves, compiled on first use and recompiled when its file changes
+@st.cache_resource
+def get_exercise_registry():
+    registry = ExerciseRegistry(EXERCISES_DIR, vars(config), build_scoring_instructions,
+        EXERCISE_CACHE_SIZE, EXERCISE_RELOAD_SECONDS)
+    get_metrics().add_collector("exercises", registry.stats)
+    return registry
+
+
+#The exercise this session is working on, resolved at the top of every full run
+def current_exercise():
+    return st.session_state.get("exercise") or get_exercise_registry().default
+
+
+#Streamlit serves the app's static folder at app/static/ when server.enableStaticServing is on
+ASSET_STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "shared")
+
+
+#SHARED_ASSET files, read once per process and again only when they change
+@st.cache_resource
+def get_asset_cache():
+    cache = AssetCache(ASSET_MEMORY_BYTES, ASSET_RELOAD_SECONDS, ASSET_STATIC_DIR)
+    get_metrics().add_collector("assets", cache.stats)
+    return cache
+
+
+def render_shared_asset(shared_asset):
+    asset = get_asset_cache().get(shared_asset["path"], shared_asset.get("name"))
+    if ASSET_STATIC_SERVING:
+        st.link_button(shared_asset["button_text"], "app/static/shared/" + get_asset_cache().publish(asset))
+        return
+    #The same bytes object on every rerun, so Streamlit stores it once for all sessions. A file too large to keep
+    #in memory is only read when it is downloaded.
+    st.download_button(label=shared_asset["button_text"],
+        data=asset.data if asset.data is not None else asset.read,
+        file_name=asset.name,
+        mime=asset.mime)
+
+
+#One upload per asset version and purpose, shared by every session. The digest is part of the key, so an edited file is uploaded again.
+@st.cache_resource(show_spinner=False)
+def upload_asset(path, name, digest, purpose):
+    asset = get_asset_cache().get(path, name)
+    uploaded = get_client().files.create(file=(asset.name, asset.read()), purpose=purpose)
+    print(f"Uploaded shared asset::: {uploaded.id}")
+    return uploaded.id
+
+
+#The OpenAI file id of the exercise's SHARED_ASSET: the pre-uploaded "file_id", or an upload when "upload" is set. None otherwise.
+def shared_asset_file_id(exercise, purpose):
+    shared_asset = exercise.SHARED_ASSET
+    if not shared_asset:
+        return None
+    if shared_asset.get("file_id"):
+        return shared_asset["file_id"]
+    if not shared_asset.get("upload"):
+        return None
+    asset = get_asset_cache().get(shared_asset["path"], shared_asset.get("name"))
     try:
-        if score >= PHASES[PHASE_NAME]["minimum_score"]:
-            st.session_state[f"{PHASE_NAME}_phase_status"] = True
-            return True
-        else:
-            st.session_state[f"{PHASE_NAME}_phase_status"] = False
-            return False
-    except:
-        st.session_state[f"{PHASE_NAME}_phase_status"] = False
+        return upload_asset(asset.path, asset.name, asset.digest, purpose)
+    except openai.APIError as e:
+        print(f"Shared asset not uploaded::: {e}")
+        return None
+
+
+def run_prescreen(phase, submission, model):
+    phase_plan = current_exercise().phase_plan
+    prior_inputs = {name: st.session_state.get(phase_plan[name].user_input_key) for name in phase_plan.index}
+    screened = prescreen(phase, submission, prior_inputs, PRESCREEN_MESSAGES)
+    if not screened:
         return False
+    st_store(submission, phase.name, "user_input")
+    st_store(screened.feedback, phase.name, "ai_response")
+    #One feedback run, plus a scoring run for scored phases
+    saved_calls = 2 if phase.scored else 1
+    #The canned feedback asks the student to submit again, so the phase stays open whatever its scoring or minimum_score
+    passed = False
+    st.session_state[phase.status_key] = False
+    if phase.scored:
+        st_store(json.dumps({"total": screened.score, "prescreen": screened.rule}), phase.name, "ai_result")
+        st_store(screened.score, phase.name, "ai_score")
+        st_store(passed, phase.name, "ai_passed")
+        record_submission(phase, passed)
+    print(f"Prescreen {screened.rule} on {phase.name}, saved {saved_calls} model calls")
+    record_metric("prescreen", phase.name, model, rule=screened.rule, saved_calls=saved_calls, passed=passed)
+    return True
 
-def skip_phase(PHASE_NAME, No_Submit=False):
-    st_store(user_input[PHASE_NAME], PHASE_NAME, "user_input")
+
+def advance_phase():
+    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, current_exercise().phase_plan.last_index)
+
+
+def check_score(PHASE_NAME):
+    phase = current_exercise().phase_plan[PHASE_NAME]
+    #None when the score couldn't be read
+    passed = st.session_state.get(phase.ai_passed_key) == True
+    st.session_state[f"{PHASE_NAME}_phase_status"] = passed
+    record_submission(phase, passed)
+    return passed
+
+def skip_phase(PHASE_NAME, submission, No_Submit=False):
+    st_store(submission, PHASE_NAME, "user_input")
     if No_Submit == False:
         st.session_state[f"{PHASE_NAME}_ai_response"] = "This phase was skipped."
     st.session_state[f"{PHASE_NAME}_phase_status"] = True
-    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES)-1)
+    record_submission(current_exercise().phase_plan[PHASE_NAME], skipped=True)
+    advance_phase()
 
 def celebration():
+    #Only needed when COMPLETION_CELEBRATION is on, so the import waits until then
+    from streamlit_extras.let_it_rain import rain
     rain(
         emoji="🥳",
         font_size=54,
@@ -247,150 +977,258 @@ def celebration():
 
 
 
+#A finished phase: the disabled field with the student's answer, and the stored AI responses
+def render_completed_phase(phase):
+    build_field(phase)
+    render_stored_responses(phase)
+
+
+def render_stored_responses(phase):
+    #If the phase has user input:
+    if phase.user_input_key in st.session_state:
+        # Then try to print the stored AI Response
+        key = phase.ai_response_key
+        #If the AI has responded:
+        if key in st.session_state:
+            #Then print the stored AI Response
+            st.info(st.session_state[key], icon ="🤖")
+        key = phase.ai_result_key
+        #If we are showing a score:
+        if key in st.session_state and current_exercise().SCORING_DEBUG_MODE == True:
+            #Then print the stored AI Response
+            st.info(st.session_state[key], icon ="🤖")
+
+
+@st.fragment
+def render_active_phase(i, openai_assistant):
+    submit_button = False
+    skip_button = False
+    exercise = openai_assistant.exercise
+    #The exercise is over once the final phase is passed or skipped, not merely answered: a prescreen hit or an unread score leaves it open
+    final_done = st.session_state.get(exercise.phase_plan.final.status_key) == True
+
+    #Store the Name of the Phase and the values for that Phase
+    PHASE = exercise.phase_plan[i]
+    PHASE_NAME = PHASE.name
+
+    # Build the field, according to the values in the PHASES dictionary. The value is this session's own; nothing is shared between sessions.
+    submission = build_field(PHASE)
+
+    key = PHASE.status_key
+    if key not in st.session_state:
+        st.session_state[key] = False
+    #If the phase isn't passed and it isn't a recap of the final phase, then give the user a submit button
+    if st.session_state[key] != True and not final_done:
+        with st.container(border=False):
+            col1, col2 = st.columns(2)
+            with col1:
+                submit_button = st.button(label=PHASE.button_label, type="primary", key=PHASE.submit_key)
+            with col2:
+                if PHASE.allow_skip:
+                    skip_button = st.button(label="Skip Question", key=PHASE.skip_key)
+
+    render_stored_responses(PHASE)
+
+    if submit_button:
+        submit_started = time.perf_counter()
+        openai_assistant.round_trips = 0
+        #Answer trivial submissions locally, without calling the model
+        if run_prescreen(PHASE, submission, openai_assistant.model):
+            st.rerun()
+        #Add INSTRUCTIONS message to the thread
+        openai_assistant.add_message_to_thread(
+            role="assistant", 
+            content=PHASE.instructions
+            )
+        #Store the users input in a session variable
+        st_store(submission, PHASE_NAME, "user_input")
+        #Start scoring on its own context while the feedback streams
+        scoring_future = None
+        #A fresh event per submit: the fragment reruns with the same manager, and a given-up submit must not cancel the next one
+        scoring_cancelled = threading.Event()
+        if CONCURRENT_SCORING and PHASE.scored:
+            scoring_future = get_scoring_executor().submit(
+                openai_assistant.score_submission, PHASE_NAME, submission, scoring_cancelled
+                )
+        #Add USER MESSAGE to the thread
+        openai_assistant.add_message_to_thread(
+            role="user", 
+            content=submission,
+            attachments=openai_assistant.asset_attachments(PHASE)
+            )
+        #Currently, all instructions are handled in the system prompts, so no need to add additional instructions here. 
+        instructions = ""
+        #Run the thread
+        try:
+            openai_assistant.run_assistant(instructions, PHASE_NAME)
+        except BaseException:
+            #A failed or busy feedback run ends the script (st.stop), and the submit with it
+            if scoring_future:
+                openai_assistant.abandon_scoring(scoring_future, scoring_cancelled)
+            raise
+        
+        if PHASE.scored:
+            if scoring_future:
+                with st.spinner('Checking Score...'):
+                    try:
+                        #Bounded by the scheduler's wait plus the run's deadline, so a class-wide burst can't leave students waiting forever
+                        result = scoring_future.result(timeout=ADMISSION_TIMEOUT + PHASE.get("deadline_seconds", RUN_DEADLINE_SECONDS))
+                    except FutureTimeout:
+                        openai_assistant.abandon_scoring(scoring_future, scoring_cancelled)
+                        stop_busy(openai_assistant)
+                    except AdmissionTimeout:
+                        stop_busy(openai_assistant)
+                    except (RunFailed, openai.APIError) as e:
+                        print(f"Scoring failed::: {e}")
+                        stop_failed(openai_assistant, "The AI couldn't score your response. Please submit again.")
+                for route, stats in openai_assistant.scoring_runs:
+                    record_metric("score", PHASE_NAME, route.model, **route_fields(route), **stats)
+                store_score(result, PHASE_NAME)
+                if exercise.SCORING_DEBUG_MODE:
+                    st.info(body=f'SCORE (DEBUG MODE): {result}', icon="🤖")
+            else:
+                openai_assistant.add_message_to_thread(
+                role="assistant", 
+                content=PHASE.scoring_instructions,
+                )
+                openai_assistant.run_assistant(instructions, PHASE_NAME, True, response_format="json")
+                fallback = openai_assistant.fallback_route(PHASE)
+                if fallback and st.session_state[PHASE.ai_passed_key] is None:
+                    print(f"Unreadable score from {PHASE.scoring_route.model}, scoring again on {fallback.model}")
+                    #Ask again, so the fallback model answers the scoring instructions rather than the unreadable reply
+                    openai_assistant.add_message_to_thread(
+                    role="assistant", 
+                    content=PHASE.scoring_instructions,
+                    )
+                    openai_assistant.run_assistant(instructions, PHASE_NAME, True, response_format="json", route=fallback)
+            passed = check_score(PHASE_NAME)
+            if passed:
+                advance_phase()
+            elif st.session_state[PHASE.ai_passed_key] is None:
+                st.warning("The AI's score couldn't be read. Please submit again.")
+            else:
+                st.warning("You haven't passed. Please try again.")
+        else: 
+            passed = None
+            st.session_state[PHASE.status_key] = True
+            advance_phase()
+
+        print(f"Round trips this submit::: {openai_assistant.round_trips}")
+        record_metric("submit", PHASE_NAME, openai_assistant.model,
+            seconds=time.perf_counter() - submit_started,
+            round_trips=openai_assistant.round_trips,
+            score=st.session_state.get(PHASE.ai_score_key) if PHASE.scored else None,
+            passed=passed)
+        #Rerun Streamlit to refresh the page
+        st.rerun()
+
+    if skip_button:
+        skip_phase(PHASE_NAME, submission)
+        st.rerun()
+
+
+    if final_done and i == st.session_state['CURRENT_PHASE']:
+        st.success(exercise.COMPLETION_MESSAGE)
+        if exercise.COMPLETION_CELEBRATION:
+            celebration()
+
+
 def main():
-    global ASSISTANT_ID
+    rerun_started = time.perf_counter()
+
+    if WARM_UP_ON_START:
+        start_warm_up()
+
+    #?exercise=<name> picks one of the exercises in EXERCISES_DIR; without it, config.py is the exercise.
+    #It is looked up again on every full run, so an edited exercise file is picked up without a restart.
+    if "exercise_name" not in st.session_state:
+        st.session_state.exercise_name = st.query_params.get("exercise", "")
+    try:
+        exercise = get_exercise_registry().get(st.session_state.exercise_name)
+    except ExerciseNotFound:
+        st.error("This exercise doesn't exist. Please check the link you were given.", icon="🚨")
+        st.stop()
+    except ValueError as e:
+        print(f"Exercise {st.session_state.exercise_name} failed to load::: {e}")
+        st.error("This exercise isn't set up correctly. Please let your instructor know.", icon="🚨")
+        st.stop()
+    st.session_state.exercise = exercise
+    phase_plan = exercise.phase_plan
 
     if 'CURRENT_PHASE' not in st.session_state:
         st.session_state.thread_obj = []
+        #The signed token in the URL lets a reload, a restart or another worker pick up where the student left off.
+        #Resuming claims the record and moves it to a fresh token, so a copied link never makes two browsers one session.
+        token = uuid.uuid4().hex
+        resumed = verify_token(get_session_secret(), st.query_params.get("session", ""))
+        record = get_session_store().claim(resumed) if resumed else None
+        if record and record.get("exercise", "") == exercise.name:
+            #Saved under the new token at the end of this run
+            restore(st.session_state, record, phase_plan)
+        elif record:
+            #A token from another exercise's link starts fresh instead of mixing the two, and leaves that record alone
+            get_session_store().save(resumed, record)
+        st.session_state.session_token = token
+        st.query_params["session"] = sign_token(get_session_secret(), token)
+
+    if METRICS_DEBUG_MODE:
+        metrics_sidebar()
 
-    st.title(APP_TITLE)
-    st.markdown(APP_INTRO)
+    st.title(exercise.APP_TITLE)
+    st.markdown(exercise.APP_INTRO)
 
-    if APP_HOW_IT_WORKS:
+    if exercise.APP_HOW_IT_WORKS:
         with st.expander("Learn how this works", expanded=False):
-            st.markdown(APP_HOW_IT_WORKS)
+            st.markdown(exercise.APP_HOW_IT_WORKS)
 
 
-    if SHARED_ASSET:
-        # Download button for the PDF
-        with open(SHARED_ASSET["path"], "rb") as asset_file:
-            st.download_button(label=SHARED_ASSET["button_text"],
-                data=asset_file,
-                file_name=SHARED_ASSET["name"],
-                mime="application/octet-stream")
+    if exercise.SHARED_ASSET:
+        render_shared_asset(exercise.SHARED_ASSET)
 
     #Create the assistant one time. Only if the Assistant ID is not found, create a new one. 
-    openai_assistant = AssistantManager()
+    openai_assistant = AssistantManager(exercise)
     
     #Run the create_assistant. It only creates a new assistant if one is not found. 
     openai_assistant.create_assistant(
-        name=ASSISTANT_NAME,
-        instructions=ASSISTANT_INSTRUCTIONS,
+        name=exercise.ASSISTANT_NAME,
+        instructions=exercise.ASSISTANT_INSTRUCTIONS,
         tools=""
     )
 
-    #Create a thread, or retrieve the existing thread if it exists in local Storage. 
-    openai_assistant.create_thread()
-    
-    i=0
+    #The thread is created by the first run, together with its messages.
 
     #Create a variable for the current phase, starting at 0
     if 'CURRENT_PHASE' not in st.session_state:
         st.session_state['CURRENT_PHASE'] = 0
+    #An edited exercise may have fewer phases than when this session started
+    st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'], phase_plan.last_index)
 
+    #Large, bold labels for every field, injected once per page
+    st.markdown(LARGE_LABEL_CSS, unsafe_allow_html=True)
 
-    #Loop until you reach the currently active phase. 
-    while  i <= st.session_state['CURRENT_PHASE']:
-        submit_button = False
-        skip_button = False
-        final_phase_name = list(PHASES.keys())[-1]
-        final_key = f"{final_phase_name}_ai_response"
-
-
-
-        # Build the field, according to the values in the PHASES dictionary
-        build_field(i, PHASES)
-        #Store the Name of the Phase and the values for that Phase
-        PHASE_NAME = list(PHASES.keys())[i]
-        PHASE_DICT = list(PHASES.values())[i]
+    #Loop until you reach the currently active phase. Finished phases are drawn once per full rerun;
+    #the active phase is a fragment, so interacting with it only reruns that phase.
+    i = 0
+    while i <= st.session_state['CURRENT_PHASE']:
+        PHASE = phase_plan[i]
 
-        key = f"{PHASE_NAME}_phase_status"
-      
         #Check phase status to automatically continue if it's a markdown phase
-        if PHASE_DICT["type"] == "markdown":
-            if key not in st.session_state:
-                st.session_state[key] = True
-                st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES) - 1)
-
-        
-        if key not in st.session_state:
-            st.session_state[key] = False
-        #If the phase isn't passed and it isn't a recap of the final phase, then give the user a submit button
-        if st.session_state[key] != True and final_key not in st.session_state:
-            with st.container(border=False):
-                col1, col2 = st.columns(2)
-                with col1:
-                    submit_button = st.button(label=PHASE_DICT.get("button_label","Submit"), type="primary", key="submit "+str(i))
-                with col2:
-                    if PHASE_DICT.get("allow_skip", False):
-                        skip_button = st.button(label="Skip Question", key="skip " + str(i))
-
-        #If the phase has user input:
-        key = f"{PHASE_NAME}_user_input"
-        if key in st.session_state:
-            # Then try to print the stored AI Response
-            key = f"{PHASE_NAME}_ai_response"
-            #If the AI has responded:
-            if key in st.session_state:
-                #Then print the stored AI Response
-                st.info(st.session_state[key], icon ="🤖")
-            key = f"{PHASE_NAME}_ai_result"
-            #If we are showing a score:
-            if key in st.session_state and SCORING_DEBUG_MODE == True:
-                #Then print the stored AI Response
-                st.info(st.session_state[key], icon ="🤖")
-
-        if submit_button:
-            #Add INSTRUCTIONS message to the thread
-            openai_assistant.add_message_to_thread(
-                role="assistant", 
-                content=PHASE_DICT.get("instructions","")
-                )
-            #Store the users input in a session variable
-            st_store(user_input[PHASE_NAME], PHASE_NAME, "user_input")
-            #Add USER MESSAGE to the thread
-            openai_assistant.add_message_to_thread(
-                role="user", 
-                content=user_input[PHASE_NAME]
-                )
-            #Currently, all instructions are handled in the system prompts, so no need to add additional instructions here. 
-            instructions = ""
-            #Run the thread
-            openai_assistant.run_assistant(instructions, PHASE_NAME)
-            
-            if PHASE_DICT.get("scored_phase","") == True:
-                if "rubric" in PHASE_DICT:
-                    scoring_instructions = build_scoring_instructions(PHASE_DICT["rubric"])
-                    openai_assistant.add_message_to_thread(
-                    role="assistant", 
-                    content=scoring_instructions,
-                    )
-                    openai_assistant.run_assistant(instructions, PHASE_NAME, True, temperature=.2,response_format="json")
-                    if check_score(PHASE_NAME):
-                        st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES)-1)
-                    else:
-                        st.warning("You haven't passed. Please try again.")
-                else:
-                    st.error('You need to include a rubric for a scored phase', icon="🚨")
-            else: 
-                st.session_state[f"{PHASE_NAME}_phase_status"] = True
-                st.session_state['CURRENT_PHASE'] = min(st.session_state['CURRENT_PHASE'] + 1, len(PHASES)-1)
+        if PHASE.type == "markdown" and PHASE.status_key not in st.session_state:
+            st.session_state[PHASE.status_key] = True
+            advance_phase()
 
-            #Rerun Streamlit to refresh the page
-            st.rerun()
-
-        if skip_button:
-            skip_phase(PHASE_NAME)
-            st.rerun()
+        if i < st.session_state['CURRENT_PHASE']:
+            render_completed_phase(PHASE)
+        else:
+            render_active_phase(i, openai_assistant)
 
+        #Increment i, but never more than the number of possible phases
+        i = min(i + 1, len(phase_plan))
 
-        if final_key in st.session_state and i == st.session_state['CURRENT_PHASE']:
-            st.success(COMPLETION_MESSAGE)
-            if COMPLETION_CELEBRATION:
-                celebration()
+    save_session()
 
-        #Increment i, but never more than the number of possible phases
-        i = min(i + 1, len(PHASES))
+    get_metrics().record("rerun", phase_plan[st.session_state['CURRENT_PHASE']].name, openai_assistant.model,
+        seconds=time.perf_counter() - rerun_started, completed_phases=st.session_state['CURRENT_PHASE'])
 
 
 
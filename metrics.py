@@ -0,0 +1,109 @@
+"""In-process latency, token and outcome metrics.
+
+Every run and submit is recorded once into a MetricsRegistry, which keeps running sums per
+label set (cheap to update under one lock), writes each record as a JSON line to a rotating
+file, and renders the sums in the Prometheus text format for the local /metrics endpoint.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+
+#Numeric record fields that are summed per label set and exported
+SUMMED_FIELDS = ("seconds", "time_to_first_token", "prompt_tokens", "completion_tokens", "saved_calls")
+
+
+class MetricsRegistry:
+
+    def __init__(self, jsonl_path="", max_bytes=10_000_000, backup_count=5):
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)
+        self.sums = defaultdict(float)
+        self.outcomes = defaultdict(int)
+        self.fallbacks = defaultdict(int)
+        self.collectors = []
+        self.logger = None
+        if jsonl_path:
+            self.logger = logging.getLogger(f"metrics.{jsonl_path}")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            if not self.logger.handlers:
+                handler = RotatingFileHandler(jsonl_path, maxBytes=max_bytes, backupCount=backup_count)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self.logger.addHandler(handler)
+
+    def record(self, kind, phase, model, **fields):
+        record = {"ts": time.time(), "kind": kind, "phase": phase, "model": model, **fields}
+        labels = (kind, phase, model)
+        with self.lock:
+            self.counts[labels] += 1
+            for field in SUMMED_FIELDS:
+                if fields.get(field) is not None:
+                    self.sums[labels + (field,)] += fields[field]
+            if fields.get("passed") is not None:
+                self.outcomes[(phase, "pass" if fields["passed"] else "fail")] += 1
+            if fields.get("fallback_from"):
+                self.fallbacks[(phase, fields["fallback_from"])] += 1
+        if self.logger:
+            self.logger.info(json.dumps(record))
+        return record
+
+    def add_collector(self, prefix, collect):
+        """Export the numbers returned by collect() as grant_feedback_<prefix>_<name> gauges."""
+        self.collectors.append((prefix, collect))
+
+    def prometheus_text(self):
+        lines = [
+            "# TYPE grant_feedback_runs_total counter",
+        ]
+        with self.lock:
+            counts = dict(self.counts)
+            sums = dict(self.sums)
+            outcomes = dict(self.outcomes)
+            fallbacks = dict(self.fallbacks)
+        for (kind, phase, model), count in sorted(counts.items()):
+            lines.append(f'grant_feedback_runs_total{{kind="{kind}",phase="{phase}",model="{model}"}} {count}')
+        for field in SUMMED_FIELDS:
+            lines.append(f"# TYPE grant_feedback_{field}_sum counter")
+            for (kind, phase, model, summed_field), total in sorted(sums.items()):
+                if summed_field == field:
+                    lines.append(f'grant_feedback_{field}_sum{{kind="{kind}",phase="{phase}",model="{model}"}} {total}')
+        lines.append("# TYPE grant_feedback_outcomes_total counter")
+        for (phase, outcome), count in sorted(outcomes.items()):
+            lines.append(f'grant_feedback_outcomes_total{{phase="{phase}",outcome="{outcome}"}} {count}')
+        #Scoring runs repeated on the fallback route, by the model whose output couldn't be read
+        lines.append("# TYPE grant_feedback_score_fallbacks_total counter")
+        for (phase, model), count in sorted(fallbacks.items()):
+            lines.append(f'grant_feedback_score_fallbacks_total{{phase="{phase}",model="{model}"}} {count}')
+        for prefix, collect in self.collectors:
+            for name, value in collect().items():
+                lines.append(f"# TYPE grant_feedback_{prefix}_{name} gauge")
+                lines.append(f"grant_feedback_{prefix}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def serve_metrics(registry, port, host="127.0.0.1"):
+    """Serve registry.prometheus_text() at http://host:port/metrics from a daemon thread."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,345 @@
+"""A local stand-in for the parts of the OpenAI API this app uses, for benchmarks and load tests.
+
+It speaks the same HTTP and server-sent-event protocol as the real API for assistants, threads,
+streamed runs (including create_and_run and cancel) and streamed chat completions, so the app runs
+against it unchanged:
+
+    python mock_llm_server.py --port 8765 --ttft 0.8 --tokens-per-second 40
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock streamlit run main.py
+
+Responses are deterministic: each one is chosen by a random generator seeded with --seed and the
+request's messages, so the same submission always gets the same feedback, score and injected
+failures. Scoring requests (response_format json_object) get rubric JSON built from the rubric in
+the request, with each criterion given full points with probability --pass-probability, otherwise
+a lower score.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scoring import parse_rubric
+
+
+FEEDBACK_WORDS = (
+    "Your introduction clearly names the organization, but the mission could come earlier. "
+    "Consider leading with the people you serve and one concrete result, such as visitor numbers. "
+    "The grant history builds credibility; say briefly what the earlier projects achieved. "
+    "A short testimonial from a partner would show your reputation in someone else's words. "
+).split(" ")
+
+
+class MockSettings:
+
+    def __init__(self, ttft=0.5, tokens_per_second=50, error_rate=0.0, failure="run", pass_probability=0.8,
+                 feedback_tokens=80, seed=0):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.failure = failure
+        self.pass_probability = pass_probability
+        self.feedback_tokens = feedback_tokens
+        self.seed = seed
+
+
+class MockState:
+    """Threads and runs the mock has handed out, so follow-up calls find them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.threads = {}
+        self.runs = {}
+        self.requests = 0
+        self.injected_failures = 0
+        self.cancelled = 0
+        #How many times each conversation has been requested, so a retry draws a fresh failure
+        self.attempts = {}
+
+    def new_id(self, prefix):
+        return f"{prefix}_mock{next(self.ids)}"
+
+
+def message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def seeded_random(settings, messages, *extra):
+    digest = hashlib.sha256(json.dumps([settings.seed, messages, *extra], sort_keys=True).encode("utf-8")).digest()
+    return random.Random(digest)
+
+
+def canned_score(rng, settings, messages):
+    """Rubric JSON for the rubric found in the request, or a bare total if there isn't one."""
+    criteria = ()
+    for text in reversed(messages):
+        criteria = parse_rubric(text)
+        if criteria:
+            break
+    scores = {}
+    for name, maximum in criteria:
+        scores[name] = maximum if rng.random() < settings.pass_probability else rng.randint(0, maximum - 1)
+    scores["total"] = sum(scores.values()) if criteria else rng.randint(0, 5)
+    return json.dumps(scores)
+
+
+def canned_feedback(rng, settings):
+    start = rng.randrange(len(FEEDBACK_WORDS))
+    words = [FEEDBACK_WORDS[(start + i) % len(FEEDBACK_WORDS)] for i in range(settings.feedback_tokens)]
+    return " ".join(words)
+
+
+def split_tokens(text):
+    #Roughly what the real API sends per delta: a word with its trailing space, or a JSON fragment
+    return re.findall(r"\S+\s*", text) or [text]
+
+
+def make_handler(settings, state):
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            try:
+                super().handle()
+            except (BrokenPipeError, ConnectionResetError):
+                #The app closed a kept-alive connection, e.g. after cancelling a stream
+                pass
+
+        def do_GET(self):
+            self.route("GET")
+
+        def do_POST(self):
+            self.route("POST")
+
+        def route(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+            path = self.path.split("?")[0].rstrip("/")
+            if path.startswith("/v1"):
+                path = path[3:]
+            with state.lock:
+                state.requests += 1
+            parts = path.strip("/").split("/")
+            if method == "POST" and parts == ["chat", "completions"]:
+                return self.chat_completion(body)
+            if parts[0] == "models" and len(parts) == 2:
+                return self.send_json({"id": parts[1], "object": "model", "created": 0, "owned_by": "mock"})
+            if parts[0] == "assistants":
+                if method == "POST":
+                    return self.send_json(self.assistant(state.new_id("asst"), body))
+                return self.send_json(self.assistant(parts[1], {}))
+            if parts == ["threads"] and method == "POST":
+                thread = self.new_thread(body.get("messages", []))
+                return self.send_json(thread)
+            if parts == ["threads", "runs"] and method == "POST":
+                thread = self.new_thread((body.get("thread") or {}).get("messages", []))
+                return self.stream_run(thread, body, created_thread=True)
+            if parts[0] == "threads" and len(parts) == 2:
+                return self.send_json(self.thread_object(parts[1]))
+            if parts[0] == "threads" and parts[2:3] == ["runs"]:
+                thread_id = parts[1]
+                if len(parts) == 3 and method == "POST":
+                    with state.lock:
+                        thread_messages = state.threads.setdefault(thread_id, [])
+                        thread_messages.extend(message_text(m) for m in body.get("additional_messages") or [])
+                    return self.stream_run(self.thread_object(thread_id), body)
+                if len(parts) == 5 and parts[4] == "cancel":
+                    with state.lock:
+                        state.runs[parts[3]] = "cancelled"
+                        state.cancelled += 1
+                    return self.send_json(self.run_object(parts[3], thread_id, "cancelled"))
+                if len(parts) == 4:
+                    with state.lock:
+                        status = state.runs.get(parts[3], "completed")
+                    return self.send_json(self.run_object(parts[3], thread_id, status))
+            self.send_json({"error": {"message": f"mock has no route for {method} {self.path}", "type": "invalid_request_error"}}, 404)
+
+        def new_thread(self, messages):
+            thread_id = state.new_id("thread")
+            with state.lock:
+                state.threads[thread_id] = [message_text(m) for m in messages]
+            return self.thread_object(thread_id)
+
+        def assistant(self, assistant_id, body):
+            return {"id": assistant_id, "object": "assistant", "created_at": 0, "name": body.get("name", "Mock assistant"),
+                    "model": body.get("model", "mock"), "instructions": body.get("instructions", ""), "tools": [], "metadata": {}}
+
+        def thread_object(self, thread_id):
+            return {"id": thread_id, "object": "thread", "created_at": 0, "metadata": {}}
+
+        def run_object(self, run_id, thread_id, status, usage=None, last_error=None):
+            return {"id": run_id, "object": "thread.run", "thread_id": thread_id, "assistant_id": "asst_mock",
+                    "created_at": 0, "status": status, "model": "mock", "instructions": "", "tools": [],
+                    "usage": usage, "last_error": last_error, "metadata": {}}
+
+        def respond(self, messages, scoring):
+            """The response text for these messages, and whether this request should fail.
+            The text only depends on the messages; failures are drawn per attempt, so a retry can succeed."""
+            rng = seeded_random(settings, messages)
+            key = json.dumps(messages)
+            with state.lock:
+                attempt = state.attempts[key] = state.attempts.get(key, 0) + 1
+            fail = seeded_random(settings, messages, "failure", attempt).random() < settings.error_rate
+            text = canned_score(rng, settings, messages) if scoring else canned_feedback(rng, settings)
+            return text, fail
+
+        def stream_run(self, thread, body, created_thread=False):
+            with state.lock:
+                messages = list(state.threads.get(thread["id"], []))
+            scoring = (body.get("response_format") or {}) == {"type": "json_object"}
+            text, fail = self.respond(messages, scoring)
+            if fail and settings.failure == "http":
+                return self.fail_http()
+            run_id = state.new_id("run")
+            with state.lock:
+                state.runs[run_id] = "in_progress"
+            self.start_events()
+            if created_thread:
+                self.send_event("thread.created", thread)
+            self.send_event("thread.run.created", self.run_object(run_id, thread["id"], "queued"))
+            self.send_event("thread.run.in_progress", self.run_object(run_id, thread["id"], "in_progress"))
+            if fail:
+                with state.lock:
+                    state.injected_failures += 1
+                error = {"code": "server_error", "message": "Injected by the mock server"}
+                self.send_event("thread.run.failed", self.run_object(run_id, thread["id"], "failed", last_error=error))
+                return self.end_events("event: done\ndata: [DONE]\n\n")
+            tokens = split_tokens(text)
+            for token in self.paced(tokens):
+                with state.lock:
+                    if state.runs.get(run_id) == "cancelled":
+                        break
+                delta = {"id": "msg_mock", "object": "thread.message.delta",
+                         "delta": {"content": [{"index": 0, "type": "text", "text": {"value": token}}]}}
+                if not self.send_event("thread.message.delta", delta):
+                    return
+            with state.lock:
+                state.runs[run_id] = "completed"
+                state.threads.setdefault(thread["id"], []).append(text)
+            prompt_tokens = sum(len(m) for m in messages) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+            self.send_event("thread.run.completed", self.run_object(run_id, thread["id"], "completed", usage=usage))
+            self.end_events("event: done\ndata: [DONE]\n\n")
+
+        def chat_completion(self, body):
+            messages = [message_text(m) for m in body.get("messages", [])]
+            scoring = (body.get("response_format") or {}) == {"type": "json_object"}
+            text, fail = self.respond(messages, scoring)
+            if fail:
+                return self.fail_http()
+            tokens = split_tokens(text)
+            self.start_events()
+            chunk = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0, "model": body.get("model", "mock")}
+            for token in self.paced(tokens):
+                if not self.send_data({**chunk, "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}], "usage": None}):
+                    return
+            prompt_tokens = sum(len(m) for m in messages) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+            self.send_data({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": None})
+            self.send_data({**chunk, "choices": [], "usage": usage})
+            self.end_events("data: [DONE]\n\n")
+
+        def paced(self, tokens):
+            """Yield tokens at the configured time-to-first-token and rate."""
+            started = time.monotonic()
+            for i, token in enumerate(tokens):
+                due = started + settings.ttft + (i / settings.tokens_per_second if settings.tokens_per_second else 0)
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                yield token
+
+        def fail_http(self):
+            with state.lock:
+                state.injected_failures += 1
+            self.send_json({"error": {"message": "Injected by the mock server", "type": "server_error"}}, 500)
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def start_events(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def write_chunk(self, text):
+            data = text.encode("utf-8")
+            try:
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+                return True
+            except (BrokenPipeError, ConnectionResetError):
+                #The client closed the stream, e.g. a decided score or a cancelled run
+                self.close_connection = True
+                return False
+
+        def send_event(self, event, data):
+            return self.write_chunk(f"event: {event}\ndata: {json.dumps(data)}\n\n")
+
+        def send_data(self, data):
+            return self.write_chunk(f"data: {json.dumps(data)}\n\n")
+
+        def end_events(self, final):
+            if self.write_chunk(final):
+                self.write_chunk("")
+
+    return MockHandler
+
+
+def serve_mock(settings, port=8765, host="127.0.0.1"):
+    """Start the mock in a daemon thread. Returns (server, state); the base URL is http://host:port/v1."""
+    state = MockState()
+    server = ThreadingHTTPServer((host, port), make_handler(settings, state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server, state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a deterministic stand-in for the OpenAI Assistants and chat APIs.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--ttft", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Streaming rate after the first token (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of runs that fail")
+    parser.add_argument("--failure", choices=("run", "http"), default="run",
+                        help="How runs fail: a thread.run.failed event with server_error, or an HTTP 500")
+    parser.add_argument("--pass-probability", type=float, default=0.8, help="Chance each rubric criterion gets full points")
+    parser.add_argument("--feedback-tokens", type=int, default=80, help="Length of the canned feedback")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(args.ttft, args.tokens_per_second, args.error_rate, args.failure,
+                            args.pass_probability, args.feedback_tokens, args.seed)
+    server, state = serve_mock(settings, args.port, args.host)
+    print(f"Mock OpenAI API at http://{args.host}:{args.port}/v1 (Ctrl+C to stop)", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(60)
+            print(f"{state.requests} requests, {state.injected_failures} injected failures, {state.cancelled} cancels", file=sys.stderr)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
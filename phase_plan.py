@@ -0,0 +1,155 @@
+"""Compile the PHASES dictionary from config.py into an immutable, indexed plan.
+
+main.py compiles PHASES once at import, so configuration mistakes (an unknown field type, a
+scored phase without a rubric) stop the app at startup instead of on a student's submit, and
+reruns look phases up by index instead of rebuilding lists and kwargs every time.
+"""
+from types import MappingProxyType
+from typing import Any, Mapping, NamedTuple, Optional
+
+from routing import Route, compile_route, fallback_route
+from scoring import parse_rubric
+
+
+WIDGET_TYPES = ("text_input", "text_area", "warning", "button", "radio", "markdown", "selectbox")
+
+#Phase dict keys passed straight through to the Streamlit widget, when set
+WIDGET_FIELDS = ("label", "body", "value", "options", "max_chars", "help", "on_click",
+                 "horizontal", "height", "unsafe_allow_html", "placeholder")
+
+
+class PhaseConfigError(ValueError):
+    pass
+
+
+class Phase(NamedTuple):
+    index: int
+    name: str
+    type: str
+    config: Mapping[str, Any]
+    widget_kwargs: Mapping[str, Any]
+    button_label: str
+    allow_skip: bool
+    scored: bool
+    rubric: str
+    minimum_score: Optional[int]
+    instructions: str
+    scoring_instructions: str
+    criteria: tuple
+    context_phases: tuple
+    feedback_route: Route
+    scoring_route: Route
+    #The scoring route on the feedback model, or None when scoring already runs there
+    fallback_route: Optional[Route]
+    status_key: str
+    user_input_key: str
+    ai_response_key: str
+    ai_result_key: str
+    ai_score_key: str
+    ai_passed_key: str
+    submit_key: str
+    skip_key: str
+
+    def get(self, key, default=None):
+        return self.config.get(key, default)
+
+
+class PhasePlan:
+    """The phases in order, with a name -> index map."""
+    __slots__ = ("phases", "index")
+
+    def __init__(self, phases):
+        self.phases = tuple(phases)
+        self.index = MappingProxyType({phase.name: phase.index for phase in self.phases})
+
+    def __len__(self):
+        return len(self.phases)
+
+    def __iter__(self):
+        return iter(self.phases)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.phases[self.index[key]]
+        return self.phases[key]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def final(self):
+        return self.phases[-1]
+
+    @property
+    def last_index(self):
+        return len(self.phases) - 1
+
+
+def compile_phase(i, name, phase_dict, build_scoring_instructions, earlier_phases=(), routes=None, default_model=""):
+    field_type = phase_dict.get("type", "")
+    if field_type not in WIDGET_TYPES:
+        raise PhaseConfigError(f"Phase '{name}' has unknown type '{field_type}'. Use one of: {', '.join(WIDGET_TYPES)}")
+
+    scored = phase_dict.get("scored_phase", "") == True
+    rubric = phase_dict.get("rubric", "")
+    minimum_score = phase_dict.get("minimum_score")
+    if scored and not rubric:
+        raise PhaseConfigError(f"Phase '{name}' is a scored phase but has no rubric")
+    if scored and not isinstance(minimum_score, (int, float)):
+        raise PhaseConfigError(f"Phase '{name}' is a scored phase but has no numeric minimum_score")
+
+    context_phases = tuple(phase_dict.get("context_phases", ()))
+    for context_phase in context_phases:
+        if context_phase not in earlier_phases:
+            raise PhaseConfigError(f"Phase '{name}' lists '{context_phase}' in context_phases, but it is not an earlier phase")
+
+    compare_to = phase_dict.get("prescreen", {}).get("compare_to")
+    if compare_to and compare_to not in earlier_phases:
+        raise PhaseConfigError(f"Phase '{name}' prescreens against '{compare_to}', but it is not an earlier phase")
+
+    try:
+        feedback_route = compile_route("feedback", routes or {}, phase_dict.get("feedback_route", {}), default_model)
+        scoring_route = compile_route("scoring", routes or {}, phase_dict.get("scoring_route", {}), default_model)
+    except ValueError as e:
+        raise PhaseConfigError(f"Phase '{name}' has {e}") from None
+
+    widget_kwargs = {field: phase_dict[field] for field in WIDGET_FIELDS if phase_dict.get(field)}
+
+    return Phase(
+        index=i,
+        name=name,
+        type=field_type,
+        config=MappingProxyType(dict(phase_dict)),
+        widget_kwargs=MappingProxyType(widget_kwargs),
+        button_label=phase_dict.get("button_label", "Submit"),
+        allow_skip=phase_dict.get("allow_skip", False),
+        scored=scored,
+        rubric=rubric,
+        minimum_score=minimum_score,
+        instructions=phase_dict.get("instructions", ""),
+        scoring_instructions=build_scoring_instructions(rubric) if scored else "",
+        criteria=parse_rubric(rubric),
+        context_phases=context_phases,
+        feedback_route=feedback_route,
+        scoring_route=scoring_route,
+        fallback_route=fallback_route(scoring_route, feedback_route),
+        status_key=f"{name}_phase_status",
+        user_input_key=f"{name}_user_input",
+        ai_response_key=f"{name}_ai_response",
+        ai_result_key=f"{name}_ai_result",
+        ai_score_key=f"{name}_ai_score",
+        ai_passed_key=f"{name}_ai_passed",
+        submit_key=f"submit {i}",
+        skip_key=f"skip {i}",
+    )
+
+
+def compile_phases(phases_dict, build_scoring_instructions, routes=None, default_model=""):
+    """routes is MODEL_ROUTES and default_model the OPENAI_MODEL for routes that don't name one."""
+    if not phases_dict:
+        raise PhaseConfigError("PHASES must define at least one phase")
+    names = list(phases_dict)
+    return PhasePlan(
+        compile_phase(i, name, phase_dict, build_scoring_instructions, names[:i], routes, default_model)
+        for i, (name, phase_dict) in enumerate(phases_dict.items())
+    )
@@ -0,0 +1,63 @@
+"""Local checks that answer trivial submissions without calling the model.
+
+A phase opts in with a "prescreen" dict in PHASES, for example:
+
+    "prescreen": {
+        "min_chars": 100,                   # shorter (or empty) submissions are sent back
+        "unchanged_from_default": True,     # the prefilled "value" submitted as is
+        "compare_to": "first_draft",        # an earlier phase the submission must differ from
+        "max_similarity": 0.97,             # difflib ratio at or above which it counts as unchanged
+        "messages": {"too_short": "..."},   # optional overrides of PRESCREEN_MESSAGES
+    }
+
+Each rule that fires returns canned feedback and a score of 0, and the phase stays open for another
+submission, scored or not.
+"""
+import difflib
+import hashlib
+from typing import NamedTuple
+
+
+class PrescreenResult(NamedTuple):
+    rule: str
+    feedback: str
+    score: int
+
+
+def normalize_submission(text):
+    return " ".join((text or "").split()).casefold()
+
+
+def submission_hash(text):
+    return hashlib.sha256(normalize_submission(text).encode("utf-8")).hexdigest()
+
+
+def prescreen(phase, submission, prior_inputs, messages):
+    """Return a PrescreenResult if a rule in the phase's "prescreen" config fires, else None.
+
+    prior_inputs maps earlier phase names to what the student submitted for them.
+    """
+    rules = phase.get("prescreen")
+    if not rules:
+        return None
+    messages = {**messages, **rules.get("messages", {})}
+    normalized = normalize_submission(submission)
+
+    def result(rule):
+        return PrescreenResult(rule, messages[rule], 0)
+
+    if len(normalized) < rules.get("min_chars", 1):
+        return result("too_short")
+    if rules.get("unchanged_from_default") and phase.get("value") and submission_hash(submission) == submission_hash(phase.get("value")):
+        return result("unchanged_from_default")
+    compare_to = rules.get("compare_to")
+    if compare_to and prior_inputs.get(compare_to) is not None:
+        prior = normalize_submission(prior_inputs[compare_to])
+        if submission_hash(submission) == submission_hash(prior):
+            return result("unchanged_from_prior")
+        threshold = rules.get("max_similarity", 1)
+        matcher = difflib.SequenceMatcher(None, prior, normalized, autojunk=False)
+        #The quick ratios are cheap upper bounds, so clearly rewritten drafts skip the full comparison
+        if matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold:
+            return result("unchanged_from_prior")
+    return None
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def response_cache_key(phase_name, kind, instructions, rubric, model, temperature, submission, context=()):
+    """Hash everything that decides the model's answer, including any earlier conversation the run reads (context).
+    Whitespace in the submission is normalized, so resubmitting the same text after a rerun or reformat still hits."""
+    normalized = " ".join((submission or "").split())
+    parts = [phase_name, kind, instructions or "", rubric or "", model, temperature, normalized, list(context)]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """A bounded in-memory LRU of model responses, backed by an optional directory on disk.
+
+    The disk tier keeps one small JSON file per key and evicts the least recently used files
+    once the directory grows past max_disk_bytes. Safe to share between sessions and threads.
+    """
+
+    def __init__(self, max_items=256, directory="", max_disk_bytes=50_000_000):
+        self.max_items = max_items
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key]
+        value = self._disk_get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+        self._disk_put(key, value)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "items": len(self.items)}
+
+    def _remember(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _disk_get(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                value = json.load(f)
+            #Touch the file so eviction treats it as recently used
+            os.utime(self._path(key))
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.directory:
+            return
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(key))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,49 @@
+"""Which model, completion limit and sampling settings each kind of run uses.
+
+MODEL_ROUTES (config.py, or an exercise) holds a route for "feedback" runs and one for "scoring"
+runs. A phase can override any field with a "feedback_route" or "scoring_route" dict, e.g. to score
+a short phase on a cheaper model:
+
+    "scoring_route": {"model": "gpt-4o-mini", "max_tokens": 150},
+
+A route without a model uses the exercise's OPENAI_MODEL. Routes are compiled with the phase plan,
+so a misspelled field stops the app at startup.
+"""
+from typing import NamedTuple, Optional
+
+
+ROUTE_KINDS = ("feedback", "scoring")
+ROUTE_FIELDS = ("model", "max_tokens", "temperature", "top_p")
+
+
+class Route(NamedTuple):
+    kind: str
+    model: str
+    #None leaves the setting to the API's default
+    max_tokens: Optional[int]
+    temperature: Optional[float]
+    top_p: Optional[float]
+    #Set on the route a scoring run falls back to after unreadable output
+    fallback_from: str = ""
+
+
+def compile_route(kind, routes, overrides, default_model):
+    """The Route for kind: routes[kind] with the phase's overrides on top. Raises ValueError for unknown fields."""
+    settings = {**routes.get(kind, {}), **overrides}
+    unknown = set(settings) - set(ROUTE_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown {kind} route settings {sorted(unknown)}; expected some of {ROUTE_FIELDS}")
+    return Route(
+        kind=kind,
+        model=settings.get("model") or default_model,
+        max_tokens=settings.get("max_tokens"),
+        temperature=settings.get("temperature"),
+        top_p=settings.get("top_p"),
+    )
+
+
+def fallback_route(scoring_route, feedback_route):
+    """The scoring route moved onto the feedback route's model, or None when they already share one."""
+    if scoring_route.model == feedback_route.model:
+        return None
+    return scoring_route._replace(model=feedback_route.model, fallback_from=scoring_route.model)
@@ -0,0 +1,116 @@
+"""Process-wide admission control for model requests.
+
+Every session asks the AdmissionScheduler before starting a run. Requests are admitted strictly in
+order (by priority, then arrival) while the requests-per-minute and tokens-per-minute buckets have
+room, so a whole class pressing Submit at once queues up instead of tripping the API rate limits.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+FEEDBACK_PRIORITY = 0
+SCORING_PRIORITY = 1
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    """Refills continuously to `capacity` per minute. A capacity of 0 means unlimited."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def has(self, amount):
+        return not self.capacity or self.level >= min(amount, self.capacity)
+
+    def take(self, amount):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + amount)
+
+    def seconds_until(self, amount):
+        if not self.capacity:
+            return 0
+        return max(0, (min(amount, self.capacity) - self.level) * 60 / self.capacity)
+
+
+class AdmissionScheduler:
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.queue = []
+        self.order = itertools.count()
+        self.condition = threading.Condition()
+        self.admitted = 0
+        self.queued = 0
+
+    def admit(self, tokens, priority=FEEDBACK_PRIORITY, timeout=None, on_wait=None):
+        """Block until this request may start. on_wait(position) is called, outside the lock,
+        whenever the caller has to wait, with its 1-based place in the queue."""
+        entry = (priority, next(self.order))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            heapq.heappush(self.queue, entry)
+        waited = False
+        try:
+            while True:
+                with self.condition:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    if self.queue[0] == entry and self.requests.has(1) and self.tokens.has(tokens):
+                        heapq.heappop(self.queue)
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self.admitted += 1
+                        self.queued += waited
+                        self.condition.notify_all()
+                        return
+                    if deadline is not None and now >= deadline:
+                        raise AdmissionTimeout(f"Not admitted within {timeout} seconds")
+                    position = sum(1 for queued in self.queue if queued < entry) + 1
+                    wait = max(self.requests.seconds_until(1), self.tokens.seconds_until(tokens), 0.05)
+                    if deadline is not None:
+                        wait = min(wait, deadline - now)
+                    #Wake up at least once a second to refresh the caller's queue position
+                    self.condition.wait(min(wait, 1))
+                waited = True
+                if on_wait:
+                    on_wait(position)
+        except BaseException:
+            with self.condition:
+                if entry in self.queue:
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                self.condition.notify_all()
+            raise
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Correct the token bucket once a run reports its real usage."""
+        with self.condition:
+            self.tokens.give(estimated_tokens - actual_tokens)
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {"admitted": self.admitted, "queued": self.queued, "waiting": len(self.queue)}
+
+
+def estimate_tokens(text):
+    #Roughly four characters per token for English text
+    return len(text or "") // 4
@@ -0,0 +1,179 @@
+"""Incremental parsing and validation of the model's JSON rubric scores.
+
+The scoring run is asked for a flat JSON object of criterion -> points (plus a "total"). ScoreParser
+reads it as it streams, checks each criterion against the points available in the phase's rubric,
+adds up the total itself, and decides pass/fail against minimum_score as soon as the remaining
+criteria can no longer change the outcome.
+"""
+import re
+
+
+#A criterion heading such as "1. Organization Introduction" and a points line such as "2 points - ..."
+CRITERION_PATTERN = re.compile(r"^\s*\d+\.\s*(.+?)\s*$")
+POINTS_PATTERN = re.compile(r"^\s*(\d+)\s+points?\b", re.IGNORECASE)
+NUMBER_PATTERN = re.compile(r"^\s*(-?\d+(?:\.\d+)?)")
+
+
+def parse_rubric(rubric):
+    """Return ((criterion, max_points), ...) from a numbered rubric, or () if it has no point lines."""
+    criteria = []
+    for line in (rubric or "").splitlines():
+        points = POINTS_PATTERN.match(line)
+        if points:
+            if criteria:
+                name, maximum = criteria[-1]
+                criteria[-1] = (name, max(maximum, int(points.group(1))))
+            continue
+        criterion = CRITERION_PATTERN.match(line)
+        if criterion:
+            criteria.append((criterion.group(1), 0))
+    return tuple(criteria) if criteria and all(maximum for _, maximum in criteria) else ()
+
+
+def normalize(name):
+    return re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+
+
+class IncrementalJSONObjectParser:
+    """Pulls top-level "key": scalar pairs out of a JSON object as its text arrives in pieces.
+
+    Nested objects and arrays are skipped, and anything before the opening brace (such as a
+    ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.token = []
+        self.key = None
+        self.after_colon = False
+        #True once the top-level object's closing brace has been read
+        self.closed = False
+
+    def feed(self, text):
+        pairs = []
+        for ch in text:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    self.token.append(ch)
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                else:
+                    self.token.append(ch)
+                continue
+            if ch == '"':
+                if self.depth == 1:
+                    self.in_string = True
+                    self.token = []
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                if self.depth == 1:
+                    self._end_value(pairs)
+                    self.closed = True
+                self.depth = max(self.depth - 1, 0)
+            elif self.depth != 1:
+                continue
+            elif ch == ":":
+                self.key = "".join(self.token)
+                self.token = []
+                self.after_colon = True
+            elif ch == ",":
+                self._end_value(pairs)
+            elif self.after_colon and not ch.isspace():
+                self.token.append(ch)
+        return pairs
+
+    def _end_value(self, pairs):
+        if self.after_colon and self.key is not None and self.token:
+            pairs.append((self.key, "".join(self.token)))
+        self.key = None
+        self.token = []
+        self.after_colon = False
+
+
+class ScoreParser:
+
+    def __init__(self, criteria, minimum_score):
+        self.criteria = criteria
+        self.minimum_score = minimum_score
+        self.max_score = sum(maximum for _, maximum in criteria)
+        self.json = IncrementalJSONObjectParser()
+        self.scores = {}
+        self.model_total = None
+        self.errors = []
+
+    def feed(self, text):
+        for key, value in self.json.feed(text):
+            self._add(key, value)
+        return self.decided
+
+    def _add(self, key, value):
+        number = NUMBER_PATTERN.match(value)
+        if normalize(key) == "total":
+            self.model_total = int(float(number.group(1))) if number else None
+            return
+        index = self._criterion_index(key)
+        if index is None:
+            #A non-numeric extra such as "comments" is fine; an extra score is not
+            if number:
+                self.errors.append(f"Unknown criterion {key!r}")
+            return
+        name, maximum = self.criteria[index]
+        if not number or not 0 <= float(number.group(1)) <= maximum:
+            self.errors.append(f"{name}: {value!r} is not between 0 and {maximum}")
+            return
+        points = float(number.group(1))
+        self.scores[index] = int(points) if points.is_integer() else points
+
+    def _criterion_index(self, key):
+        wanted = normalize(key)
+        unscored = [i for i in range(len(self.criteria)) if i not in self.scores]
+        for i in unscored:
+            name = normalize(self.criteria[i][0])
+            if wanted and (wanted == name or wanted in name or name in wanted):
+                return i
+        #Keys like "criteria 2" name their criterion by number. Anything else is unknown, never guessed by position.
+        position = re.search(r"\d+", wanted)
+        if position and int(position.group()) - 1 in unscored:
+            return int(position.group()) - 1
+        return None
+
+    @property
+    def score(self):
+        """Points awarded so far, from the criteria that have been read."""
+        return sum(self.scores.values())
+
+    @property
+    def complete(self):
+        return bool(self.criteria) and len(self.scores) == len(self.criteria)
+
+    @property
+    def missing(self):
+        """True when the object has ended without a score for every criterion."""
+        return self.json.closed and not self.complete
+
+    @property
+    def decided(self):
+        """True once the pass/fail outcome can't change, whatever the remaining criteria score.
+        Never True for output with invalid or missing criteria."""
+        if not self.criteria or self.errors or self.missing:
+            return False
+        remaining = sum(maximum for i, (_, maximum) in enumerate(self.criteria) if i not in self.scores)
+        return self.score >= self.minimum_score or self.score + remaining < self.minimum_score
+
+    @property
+    def passed(self):
+        return self.decided and self.score >= self.minimum_score
+
+    def final_score(self):
+        """The locally recomputed score once every criterion is read without errors. The model's own total is
+        only used for a rubric without per-criterion points. None otherwise, so malformed output is never
+        mistaken for a score, and a run stopped at an early decision never reports its partial sum as the score."""
+        if self.criteria:
+            return self.score if self.complete and not self.errors else None
+        return self.model_total
@@ -0,0 +1,258 @@
+"""Session progress that outlives one Streamlit process.
+
+Each session's progress is a compact JSON record keyed by its session token: the exercise, the current phase, the thread id and, per phase, the status, input,
+feedback and score. A store is anything with load/save/flush/stats. MemorySessionStore keeps records in the process;
+SQLiteSessionStore shares them between worker processes through one SQLite file in WAL mode, and
+writes them behind the UI in batches from a background thread, so saving never waits on the disk.
+
+The page URL carries the token signed with a secret, so only tokens this app issued are accepted. A
+resume claims the record, taking it out of the store; the resumed session saves it under a new token.
+A link that gets shared therefore resumes at most once, and two browsers never share one live session.
+"""
+import atexit
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+
+#Record field -> Phase attribute holding the session_state key it comes from
+PHASE_FIELDS = (
+    ("status", "status_key"),
+    ("input", "user_input_key"),
+    ("response", "ai_response_key"),
+    ("result", "ai_result_key"),
+    ("score", "ai_score_key"),
+    ("passed", "ai_passed_key"),
+)
+
+
+def snapshot(state, phase_plan):
+    """The compact record for a session_state. Phases the student hasn't reached are left out."""
+    phases = {}
+    for phase in phase_plan:
+        fields = {field: state[getattr(phase, key)] for field, key in PHASE_FIELDS if getattr(phase, key) in state}
+        if fields:
+            phases[phase.name] = fields
+    thread = state.get("thread_obj")
+    return {
+        "exercise": state.get("exercise_name", ""),
+        "phase": state.get("CURRENT_PHASE", 0),
+        "thread": getattr(thread, "id", None) or state.get("thread_id"),
+        "thread_tokens": state.get("thread_tokens", 0),
+        "phases": phases,
+    }
+
+
+def restore(state, record, phase_plan):
+    """Put a saved record back into an empty session_state. Phases no longer in PHASES are ignored."""
+    state["CURRENT_PHASE"] = min(record.get("phase", 0), phase_plan.last_index)
+    if record.get("thread"):
+        state["thread_id"] = record["thread"]
+    state["thread_tokens"] = record.get("thread_tokens", 0)
+    for name, fields in record.get("phases", {}).items():
+        if name not in phase_plan:
+            continue
+        phase = phase_plan[name]
+        for field, key in PHASE_FIELDS:
+            if field in fields:
+                state[getattr(phase, key)] = fields[field]
+
+
+def load_secret(path):
+    """The SESSION_SECRET environment variable, or a random secret kept in the file at path (created on first use),
+    so every worker process on the host signs tokens alike."""
+    if os.environ.get("SESSION_SECRET"):
+        return os.environ["SESSION_SECRET"].encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    secret = secrets.token_hex(32).encode("ascii")
+    try:
+        #O_EXCL: when two workers start together, the first secret written wins and both read it
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secret)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read()
+    return secret
+
+
+def sign_token(secret, token):
+    return f"{token}.{hmac.new(secret, token.encode('utf-8'), hashlib.sha256).hexdigest()[:32]}"
+
+
+def verify_token(secret, signed):
+    """The token in a signed one, or None if the signature doesn't match."""
+    token, _, signature = (signed or "").rpartition(".")
+    if token and hmac.compare_digest(sign_token(secret, token), signed):
+        return token
+    return None
+
+
+class MemorySessionStore:
+    """Records kept in this process only; progress survives a page reload but not a restart."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        self.saves = 0
+
+    def load(self, token):
+        with self.lock:
+            return self.records.get(token)
+
+    def save(self, token, record):
+        with self.lock:
+            self.records[token] = record
+            self.saves += 1
+
+    def claim(self, token):
+        """Load and remove a record, so only one session can resume it."""
+        with self.lock:
+            return self.records.pop(token, None)
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        with self.lock:
+            return {"sessions": len(self.records), "saves": self.saves}
+
+
+class SQLiteSessionStore:
+    """Records in a SQLite file shared by every worker process on the host.
+
+    save() only queues the record; a writer thread upserts everything queued in one transaction every
+    flush_seconds, or sooner once batch_size sessions are waiting. Only the latest record of each
+    session is written, so a burst of reruns costs one row write. The same thread deletes records not
+    saved for ttl_seconds, checking at most every purge_seconds.
+    """
+
+    def __init__(self, path, flush_seconds=0.5, batch_size=100, ttl_seconds=0, purge_seconds=600):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.ttl_seconds = ttl_seconds
+        self.purge_seconds = purge_seconds
+        self.purged_at = None
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = {}
+        self.saves = 0
+        self.batches = 0
+        self.rows_written = 0
+        self.rows_purged = 0
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        #WAL keeps readers and the writer out of each other's way; NORMAL is durable across app crashes
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA busy_timeout=5000")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (token TEXT PRIMARY KEY, record TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        threading.Thread(target=self._write_behind, name="session-writer", daemon=True).start()
+        atexit.register(self.flush)
+
+    def load(self, token):
+        #A record still waiting to be written is newer than the one on disk
+        with self.lock:
+            if token in self.pending:
+                return self.pending[token]
+        with self.db_lock:
+            row = self.db.execute("SELECT record FROM sessions WHERE token = ?", (token,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, token, record):
+        with self.lock:
+            self.pending[token] = record
+            self.saves += 1
+            waiting = len(self.pending)
+        if waiting >= self.batch_size:
+            self.wake.set()
+
+    def claim(self, token):
+        """Load and remove a record, so only one session, in any worker process, can resume it."""
+        with self.db_lock:
+            with self.lock:
+                record = self.pending.pop(token, None)
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                row = self.db.execute("SELECT record FROM sessions WHERE token = ?", (token,)).fetchone()
+                self.db.execute("DELETE FROM sessions WHERE token = ?", (token,))
+                self.db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"Session claim failed::: {e}")
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+                return record
+        #A record still waiting to be written is newer than the one on disk
+        if record is None and row:
+            record = json.loads(row[0])
+        return record
+
+    def flush(self):
+        #Holding db_lock from taking the batch to committing it keeps batches in order, and makes a
+        #load() that missed the queued record wait for it to reach the table
+        with self.db_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return
+            now = time.time()
+            rows = [(token, json.dumps(record, separators=(",", ":")), now) for token, record in batch.items()]
+            try:
+                self.db.execute("BEGIN IMMEDIATE")
+                self.db.executemany(
+                    "INSERT INTO sessions (token, record, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(token) DO UPDATE SET record = excluded.record, updated = excluded.updated",
+                    rows,
+                )
+                self.db.execute("COMMIT")
+            except sqlite3.Error as e:
+                print(f"Session flush failed::: {e}")
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+                #Put the batch back, unless a newer record for the same session arrived meanwhile
+                with self.lock:
+                    self.pending = {**batch, **self.pending}
+                return
+        with self.lock:
+            self.batches += 1
+            self.rows_written += len(rows)
+
+    def purge(self):
+        """Delete records last saved more than ttl_seconds ago."""
+        with self.db_lock:
+            try:
+                deleted = self.db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl_seconds,)).rowcount
+                #Hand the freed WAL pages back, so the log doesn't keep growing
+                self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                print(f"Session purge failed::: {e}")
+                return
+        with self.lock:
+            self.rows_purged += deleted
+
+    def stats(self):
+        with self.lock:
+            return {"pending": len(self.pending), "saves": self.saves, "batches": self.batches, "rows_written": self.rows_written,
+                    "rows_purged": self.rows_purged}
+
+    def _write_behind(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            self.flush()
+            if self.ttl_seconds and (self.purged_at is None or time.monotonic() - self.purged_at >= self.purge_seconds):
+                self.purged_at = time.monotonic()
+                self.purge()
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import config
+from main import build_scoring_instructions, parse_score
+from phase_plan import compile_phases
+from scoring import ScoreParser
+
+
+@pytest.fixture
+def final_draft():
+    return compile_phases(config.PHASES, build_scoring_instructions)["final_draft"]
+
+
+def test_criteria_are_added_up_locally(final_draft):
+    text = json.dumps({"Organization Introduction": 2, "Credibility": 2, "Accomplishments and testimonials": 0, "total": 1})
+    assert parse_score(text, final_draft) == (4, True)
+
+
+def test_unknown_criterion_is_unreadable(final_draft):
+    text = json.dumps({"Organization Introduction": 0, "Credibility": 0, "Accomplishments and testimonials": 0,
+                       "Bonus": 4, "total": 4})
+    assert parse_score(text, final_draft) == (None, None)
+
+
+def test_out_of_range_criteria_are_unreadable(final_draft):
+    text = json.dumps({"Organization Introduction": 7, "Credibility": 9, "Accomplishments and testimonials": 3, "total": 5})
+    assert parse_score(text, final_draft) == (None, None)
+
+
+def test_missing_criteria_are_unreadable(final_draft):
+    text = json.dumps({"Organization Introduction": 0, "Credibility": 0, "total": 4})
+    assert parse_score(text, final_draft) == (None, None)
+
+
+def test_early_decision_has_an_outcome_but_no_score(final_draft):
+    parser = ScoreParser(final_draft.criteria, final_draft.minimum_score)
+    assert parser.feed('{"Organization Introduction": 0, "Credibility": 1,')
+    assert parse_score('{"Organization Introduction": 0, "Credibility": 1,', final_draft) == (None, False)
+
+
+def test_model_total_without_rubric_points(final_draft):
+    phase = final_draft._replace(criteria=())
+    assert parse_score('{"total": 4}', phase) == (4, True)